@@ -0,0 +1,386 @@
+#! /usr/bin/env python3
+"""Benchmarks for the audio-to-keystroke pipeline
+
+Replays raw audio (16KHz mono s16le, synthetic unless --audio is given)
+and canned Utterance records (utterances.json) through each stage of
+the pipeline and reports throughput and p50/p99 latency per stage:
+
+    voice_runs -- daemon.produce_voice_runs, per frame produced
+    metadata -- daemon.iter_metadata with a stub model, per event produced
+    interpret -- Interpreter.process_event, per utterance
+    apply_rules -- models.apply_rules, per transcript
+    tokenize -- Tokenizer.__call__, per interpreted text
+    uinput -- UInput.parse_input_string, per interpreted text
+
+The report can be written as json (--output) and a later run compared
+against it (--compare) to spot regressions between releases:
+
+    python -m benchmarks.pipeline --output baseline.json
+    python -m benchmarks.pipeline --compare baseline.json
+"""
+import logging, os, io, json, time, platform, collections, sys
+import numpy as np
+from listener import daemon, defaults, models, interpreter, tokenizer
+from listener.context import Context
+from listener.uinputdriver import UInput
+
+log = logging.getLogger(__name__)
+HERE = os.path.dirname(os.path.abspath(__file__))
+UTTERANCES_FILE = os.path.join(HERE, 'utterances.json')
+REPORT_VERSION = 1
+# words per second of (stub) recognised audio
+WORD_RATE = 3.0
+
+Metadata = collections.namedtuple('Metadata', ('transcripts',))
+CandidateTranscript = collections.namedtuple(
+    'CandidateTranscript', ('tokens', 'confidence')
+)
+TokenMetadata = collections.namedtuple('TokenMetadata', ('text', 'start_time'))
+
+
+def get_options():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the stages of the audio-to-keystroke pipeline',
+    )
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        default=False,
+        action='store_true',
+        help='Enable verbose logging (for developmen/debugging)',
+    )
+    parser.add_argument(
+        '--audio',
+        default=None,
+        help='Raw 16KHz mono s16le audio file to replay (default synthetic audio)',
+    )
+    parser.add_argument(
+        '--utterances',
+        default=UTTERANCES_FILE,
+        help='Json file with a list of canned Utterance records to interpret',
+    )
+    parser.add_argument(
+        '--context',
+        default=defaults.DEFAULT_CONTEXT,
+        help='Context whose rules are used to interpret the utterances',
+    )
+    parser.add_argument(
+        '--repeat',
+        default=20,
+        type=int,
+        help='Number of times to replay the audio and utterances',
+    )
+    parser.add_argument(
+        '--output', default=None, help='Write the json report to this file',
+    )
+    parser.add_argument(
+        '--compare',
+        default=None,
+        help='Compare against a previous json report, exits with an error on regression',
+    )
+    parser.add_argument(
+        '--threshold',
+        default=0.2,
+        type=float,
+        help='Fractional slow-down in p50/p99 latency counted as a regression',
+    )
+    return parser
+
+
+class StageTimer(object):
+    """Collects per-item latencies for a pipeline stage"""
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.samples = []
+
+    def call(self, function, *args, **named):
+        """Call function, recording how long it took"""
+        started = time.perf_counter()
+        result = function(*args, **named)
+        self.samples.append(time.perf_counter() - started)
+        return result
+
+    def iterate(self, iterable):
+        """Iterate over iterable, recording how long each item took to produce"""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except (StopIteration, IOError):
+                return
+            self.samples.append(time.perf_counter() - started)
+            yield item
+
+    def report(self):
+        """Summarise our samples as a json-compatible struct"""
+        samples = np.array(self.samples or [0.0])
+        total = float(samples.sum())
+        return {
+            'unit': self.unit,
+            'count': len(self.samples),
+            'total': total,
+            'throughput': len(self.samples) / total if total else 0.0,
+            'p50': float(np.percentile(samples, 50)),
+            'p99': float(np.percentile(samples, 99)),
+        }
+
+
+class StubModel(object):
+    """Stands in for a DeepSpeech model, recognising canned word lists
+
+    Each utterance (stream) "recognises" the next word list, partial
+    decodes produce the words covered by the audio fed so far.
+    """
+
+    def __init__(self, word_lists, rate=defaults.SAMPLE_RATE):
+        self.word_lists = word_lists
+        self.rate = rate
+        self.count = 0
+
+    def sampleRate(self):
+        return self.rate
+
+    def createStream(self):
+        words = self.word_lists[self.count % len(self.word_lists)]
+        self.count += 1
+        return StubStream(self, words)
+
+
+class StubStream(object):
+    def __init__(self, model, words):
+        self.model = model
+        self.words = words
+        self.length = 0
+
+    def feedAudioContent(self, frame):
+        self.length += len(frame)
+
+    def metadata(self, words):
+        tokens = []
+        for index, word in enumerate(words):
+            start = index / WORD_RATE
+            if tokens:
+                tokens.append(TokenMetadata(' ', start))
+            tokens.extend(TokenMetadata(char, start) for char in word)
+        return Metadata([CandidateTranscript(tokens, -1.0 * len(words))])
+
+    def intermediateDecodeWithMetadata(self):
+        count = int(self.length / self.model.rate * WORD_RATE) + 1
+        return self.metadata(self.words[:count])
+
+    def finishStreamWithMetadata(self, count=1):
+        return self.metadata(self.words)
+
+
+def load_utterances(filename=UTTERANCES_FILE):
+    """Load canned Utterance records from a json file"""
+    with open(filename) as fh:
+        return [models.Utterance.parse_obj(record) for record in json.load(fh)]
+
+
+def synthetic_audio(count, rate=defaults.SAMPLE_RATE, speech=1.5, silence=0.8):
+    """Produce count runs of voice-like audio separated by silence
+
+    The "voice" is a buzz with harmonics and a syllable-rate envelope,
+    which webrtcvad reliably detects as speech.
+    """
+    random = np.random.default_rng(1)
+    t = np.arange(int(rate * speech)) / rate
+    gap = random.normal(0, 10, int(rate * silence))
+    chunks = [gap]
+    for index in range(count):
+        pitch = 100 + 10 * (index % 5)
+        buzz = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 20))
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+        chunks.append(buzz * envelope * 3000)
+        chunks.append(gap)
+    return np.concatenate(chunks).astype(np.int16).tobytes()
+
+
+def bench_voice_runs(audio, repeat):
+    timer = StageTimer('voice_runs', 'frame')
+    for _ in range(repeat):
+        for _ in timer.iterate(daemon.produce_voice_runs(io.BytesIO(audio))):
+            pass
+    return timer
+
+
+def bench_metadata(audio, utterances, repeat):
+    timer = StageTimer('metadata', 'event')
+    model = StubModel([utterance.transcripts[0].words for utterance in utterances])
+    for _ in range(repeat):
+        for _ in timer.iterate(daemon.iter_metadata(model, io.BytesIO(audio))):
+            pass
+    return timer
+
+
+def bench_interpret(context, utterances, repeat):
+    timer = StageTimer('interpret', 'utterance')
+    interp = interpreter.Interpreter(
+        current_context_name=context.name, current_context=context
+    )
+    results = []
+    for _ in range(repeat):
+        results = [
+            timer.call(interp.process_event, context, utterance.copy(deep=True))
+            for utterance in utterances
+        ]
+    return timer, [result.best_guess().text for result in results]
+
+
+def bench_apply_rules(context, utterances, repeat):
+    timer = StageTimer('apply_rules', 'transcript')
+    word_lists = [
+        transcript.words
+        for utterance in utterances
+        for transcript in utterance.transcripts
+    ]
+    for _ in range(repeat):
+        for words in word_lists:
+            timer.call(
+                models.apply_rules,
+                models.Transcript(words=words),
+                context.automaton,
+                context=context,
+            )
+    return timer
+
+
+def bench_tokenize(texts, repeat):
+    timer = StageTimer('tokenize', 'text')
+    words = set(word.lower() for text in texts for word in text.split())
+    tokenize = tokenizer.Tokenizer(models.Dictionary(words=words))
+    for _ in range(repeat):
+        for text in texts:
+            timer.call(tokenize, text)
+    return timer
+
+
+def bench_uinput(texts, repeat):
+    timer = StageTimer('uinput', 'text')
+    # parsing does not need the (privileged) device
+    uinput = UInput.__new__(UInput)
+    for _ in range(repeat):
+        for text in texts:
+            timer.call(uinput.parse_input_string, text)
+    return timer
+
+
+def run_benchmarks(audio, utterances, context, repeat=20):
+    """Run each stage, returning the json-compatible report"""
+    # warm the caches (rules, key mappings, etc) outside of the timings
+    context.preload()
+    UInput.get_key_mapping()
+    timers = [
+        bench_voice_runs(audio, repeat),
+        bench_metadata(audio, utterances, repeat),
+    ]
+    timer, texts = bench_interpret(context, utterances, repeat)
+    timers += [
+        timer,
+        bench_apply_rules(context, utterances, repeat),
+        bench_tokenize(texts, repeat),
+        bench_uinput(texts, repeat),
+    ]
+    return {
+        'version': REPORT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'audio_seconds': len(audio) / 2 / defaults.SAMPLE_RATE,
+        'stages': dict((timer.name, timer.report()) for timer in timers),
+    }
+
+
+def format_report(report):
+    lines = [
+        '%-12s %10s %12s %10s %10s'
+        % ('stage', 'count', 'per-second', 'p50 (ms)', 'p99 (ms)')
+    ]
+    for name, stage in report['stages'].items():
+        lines.append(
+            '%-12s %10d %12.1f %10.3f %10.3f'
+            % (
+                name,
+                stage['count'],
+                stage['throughput'],
+                stage['p50'] * 1000,
+                stage['p99'] * 1000,
+            )
+        )
+    return '\n'.join(lines)
+
+
+def compare_reports(baseline, current, threshold=0.2):
+    """Compare the latencies in two reports
+
+    returns [(stage, measure, baseline, current, ratio, regressed)]
+    """
+    result = []
+    for name, stage in current['stages'].items():
+        previous = baseline['stages'].get(name)
+        if previous is None:
+            continue
+        for measure in ('p50', 'p99'):
+            if not previous[measure]:
+                continue
+            ratio = stage[measure] / previous[measure]
+            result.append(
+                (
+                    name,
+                    measure,
+                    previous[measure],
+                    stage[measure],
+                    ratio,
+                    ratio > 1.0 + threshold,
+                )
+            )
+    return result
+
+
+def main():
+    options = get_options().parse_args()
+    logging.basicConfig(level=logging.DEBUG if options.verbose else logging.WARNING)
+    utterances = load_utterances(options.utterances)
+    if options.audio:
+        with open(options.audio, 'rb') as fh:
+            audio = fh.read()
+    else:
+        audio = synthetic_audio(len(utterances))
+    context = Context.by_name(options.context)
+    report = run_benchmarks(audio, utterances, context, repeat=options.repeat)
+    print(format_report(report))
+    if options.output:
+        with open(options.output, 'w') as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as fh:
+            baseline = json.load(fh)
+        regressions = 0
+        for name, measure, previous, current, ratio, regressed in compare_reports(
+            baseline, report, options.threshold
+        ):
+            print(
+                '%-12s %s %10.3f => %10.3f ms (%0.2fx)%s'
+                % (
+                    name,
+                    measure,
+                    previous * 1000,
+                    current * 1000,
+                    ratio,
+                    ' REGRESSION' if regressed else '',
+                )
+            )
+            regressions += regressed
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
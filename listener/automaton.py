@@ -0,0 +1,184 @@
+"""Compiled matching automaton for rule tries
+
+The rule trie produced by ruleloader.load_rules is a nested dict keyed
+by words, with ${word} and ${phrase} wildcards and the rule stored under
+the None key. Matching it by walking the trie again from every start
+offset is quadratic in the transcript length, so instead we compile the
+trie into integer-numbered states and run one matching thread per
+candidate start offset in parallel, so that every match in a transcript
+is found in a single left-to-right pass.
+
+At each state transitions are tried in the same order as the trie walk,
+literal words, then ${word}, then ${phrase}. A ${phrase} consumes the
+rest of the transcript. Wildcards are not allowed as the first word of
+a rule. For each start offset the longest accepted match is reported.
+"""
+import logging, collections
+from . import defaults
+
+log = logging.getLogger(__name__)
+
+NO_STATE = -1
+ROOT = 0
+
+
+class RuleAutomaton(object):
+    """Rule trie compiled into integer states for single-pass matching
+
+    literals -- per-state dict mapping word to next state
+    word -- per-state ${word} transition (or NO_STATE)
+    phrase -- per-state ${phrase} transition (or NO_STATE)
+    accept -- per-state rule accepted in that state (or None)
+    max_depth -- the largest number of words (wildcards counting as
+                 a single word) in any rule
+    """
+
+    def __init__(self, rules):
+        self.literals = []
+        self.word = []
+        self.phrase = []
+        self.accept = []
+        self.max_depth = 0
+        self.compile(rules)
+
+    def __len__(self):
+        return len(self.accept)
+
+    def add_state(self):
+        self.literals.append({})
+        self.word.append(NO_STATE)
+        self.phrase.append(NO_STATE)
+        self.accept.append(None)
+        return len(self.accept) - 1
+
+    def compile(self, rules):
+        """Compile the rule trie into our state tables (breadth first)"""
+        pending = [(self.add_state(), rules, 0)]
+        while pending:
+            following = []
+            for state, branch, depth in pending:
+                self.max_depth = max(self.max_depth, depth)
+                for key, value in branch.items():
+                    if key is None:
+                        self.accept[state] = value
+                        continue
+                    target = self.add_state()
+                    if key == defaults.WORD_MARKER and state != ROOT:
+                        self.word[state] = target
+                    elif key == defaults.PHRASE_MARKER and state != ROOT:
+                        self.phrase[state] = target
+                    else:
+                        self.literals[state][key] = target
+                    following.append((target, value, depth + 1))
+            pending = following
+        log.debug(
+            "Compiled %s rule states, max depth %s", len(self.accept), self.max_depth
+        )
+        return self
+
+    def matches(self, words, start=0, stop=None):
+        """Find the longest match at each start offset in start:stop
+
+        Matches starting before stop may extend past it.
+
+        yields (start, stop, rule, var_words, var_phrase) in order of start
+        as soon as the match for that start is settled
+        """
+        if stop is None:
+            stop = len(words)
+        literals, word_states, phrase_states, accept = (
+            self.literals,
+            self.word,
+            self.phrase,
+            self.accept,
+        )
+        root = literals[ROOT]
+        # each thread is [start, state, var_words, best-match-so-far]
+        threads = collections.deque()
+        for position in range(start, len(words)):
+            word = words[position]
+            if position < stop:
+                if word in root:
+                    threads.append([position, ROOT, (), None])
+            elif not threads:
+                return
+            for thread in threads:
+                state = thread[1]
+                if state == NO_STATE:
+                    continue
+                following = literals[state].get(word)
+                if following is None and state != ROOT:
+                    following = word_states[state]
+                    if following != NO_STATE:
+                        thread[2] += (word,)
+                    else:
+                        following = phrase_states[state]
+                        if following != NO_STATE:
+                            if accept[following] is not None:
+                                thread[3] = (
+                                    thread[0],
+                                    len(words),
+                                    accept[following],
+                                    list(thread[2]),
+                                    words[position:],
+                                )
+                            # a phrase consumes the rest of the words
+                            following = NO_STATE
+                elif following is None:
+                    following = NO_STATE
+                thread[1] = following
+                if following != NO_STATE and accept[following] is not None:
+                    thread[3] = (
+                        thread[0],
+                        position + 1,
+                        accept[following],
+                        list(thread[2]),
+                        None,
+                    )
+            # report matches from the leftmost threads once they are finished
+            while threads and threads[0][1] == NO_STATE:
+                best = threads.popleft()[3]
+                if best is not None:
+                    yield best
+        for thread in threads:
+            if thread[3] is not None:
+                yield thread[3]
+
+    def open_at_end(self, words):
+        """Could a rule match starting in words continue past their end?"""
+        last = 0
+        for last in self.boundaries(words):
+            pass
+        return last != len(words)
+
+    def boundaries(self, words):
+        """Find the offsets in words which no rule match can span
+
+        yields each offset (0 < offset <= len(words)) such that no rule
+        which started matching before the offset could continue past it,
+        so words before and after it can be interpreted independently
+        """
+        literals, word_states, phrase_states = self.literals, self.word, self.phrase
+        root = literals[ROOT]
+        states = []
+        for position, word in enumerate(words):
+            if word in root:
+                states.append(ROOT)
+            following = []
+            for state in states:
+                target = literals[state].get(word)
+                if target is None and state != ROOT:
+                    target = word_states[state]
+                    if target == NO_STATE and phrase_states[state] != NO_STATE:
+                        # a phrase consumes the rest of the words
+                        return
+                if target is not None and target != NO_STATE:
+                    if (
+                        literals[target]
+                        or word_states[target] != NO_STATE
+                        or phrase_states[target] != NO_STATE
+                    ):
+                        following.append(target)
+            states = following
+            if not states:
+                yield position + 1
@@ -32,7 +32,7 @@ class CommandScorer(pydantic.BaseModel):
                     '% 8s %s', '%0.1f' % (transcript.confidence), transcript.tokens,
                 )
         for transcript in utterance.transcripts:
-            match = models.match_rules(transcript.words, self.context.rules)
+            match = models.match_rules(transcript.words, self.context.automaton)
             if match:
                 transcript.confidence += self.command_bias
                 log.info("Adding to score of %s", transcript.words)
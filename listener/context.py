@@ -1,10 +1,17 @@
-import re, logging, os, json
+import re, logging, os, json, threading, collections, functools, itertools
+from concurrent.futures import Future, ThreadPoolExecutor
 import pydantic, typing
 from . import defaults, ruleloader, models
 from . import kenlmscorer, commandscorer
 
 log = logging.getLogger(__name__)
 
+# Named rules which switch to a fixed context
+CONTEXT_SWITCHES = {
+    'stop_listening': defaults.STOPPED_CONTEXT,
+    'start_spelling': defaults.SPELLING_CONTEXT,
+}
+
 
 class Context(models.Context):
     """And interpretation context for our interpreter
@@ -40,9 +47,20 @@ class Context(models.Context):
                 initial[boost_word] = max((initial.get(boost_word, 0), boost))
         return initial
 
+    @models.justonce_property
+    def boost_index(self):
+        """Combined rule and hotword boost for each boosted word"""
+        index = dict(self.boosts)
+        for word, boost in self.hotwords.items():
+            index[word] = index.get(word, 0) + boost
+        return index
+
     def add_hotwords(self, boosts: typing.Dict[str, float]):
         """Add to the boosts for hotwords on context scoring"""
         self.hotwords.update(boosts)
+        index, rule_boosts = self.boost_index, self.boosts
+        for word in boosts:
+            index[word] = rule_boosts.get(word, 0) + self.hotwords[word]
         return self.hotwords
 
     @property
@@ -50,6 +68,11 @@ class Context(models.Context):
         """Get the rule set for interpretation"""
         return self.loaded_rules[0]
 
+    @models.justonce_property
+    def automaton(self):
+        """Get the rules compiled for single-pass matching"""
+        return models.compile_rules(self.rules)
+
     @property
     def rule_set(self):
         """Get the rule-set for editing purposes"""
@@ -64,6 +87,37 @@ class Context(models.Context):
             if scorer.type in self.SCORER_CLASSES
         ]
 
+    def preload(self):
+        """Load the rules, matching tables and scorer models up-front"""
+        self.automaton
+        self.boost_index
+        for scorer in self.scorers:
+            preload = getattr(scorer, 'preload', None)
+            if preload is not None:
+                try:
+                    preload()
+                except Exception:
+                    log.exception(
+                        "Unable to preload scorer %s for %s", scorer.name, self.name
+                    )
+        return self
+
+    def close(self):
+        """Release the (potentially large) resources held by our scorers"""
+        for scorer in self.scorers:
+            close = getattr(scorer, 'close', None)
+            if close is not None:
+                close()
+
+    def reachable_contexts(self):
+        """Give the names of contexts our rules can switch to directly"""
+        names = [defaults.DEFAULT_CONTEXT]
+        for rule in self.rule_set:
+            name = CONTEXT_SWITCHES.get(rule.target.strip('^').rstrip('()'))
+            if name and name not in names:
+                names.append(name)
+        return names
+
     def score(self, event: models.Utterance, max_count: int = 20):
         """Apply our scorers to the event
         
@@ -78,11 +132,9 @@ class Context(models.Context):
             log.debug("Score with %s", scorer.definition.name)
             scorer.score(event)
 
+        lookup = self.boost_index.get
         for transcript in event.transcripts:
-            boost = 0
-            for word in transcript.words:
-                for boosts in (self.boosts, self.hotwords):
-                    boost += boosts.get(word, 0)
+            boost = sum(map(lookup, transcript.words, itertools.repeat(0)))
             if boost:
                 log.debug('Boosting confidence on %s by %s', transcript.words, boost)
             transcript.confidence += boost
@@ -99,7 +151,7 @@ class Context(models.Context):
                  we agree to process the first item
         
         """
-        rules = self.rules
+        rules = self.automaton
         for transcript in event.transcripts[:5]:
             original = transcript.words[:]
             new_words = models.apply_rules(
@@ -115,3 +167,92 @@ class Context(models.Context):
                 transcript.text = models.words_to_text(new_words)
 
         return event
+
+
+class ContextPool(object):
+    """LRU pool of live Contexts with background preloading
+
+    Loading a context loads its rules and scorers (including language
+    models), so switching contexts (stop listening, start spelling, etc.)
+    re-uses the loaded Context where possible, and the contexts reachable
+    from the current one are loaded in the background so the switch does
+    not stall processing of the next utterance.
+
+    size -- number of contexts to keep loaded
+    factory -- callable creating a Context from a name
+    """
+
+    def __init__(self, size=6, factory=None):
+        self.size = size
+        self.factory = factory or Context.by_name
+        self.contexts = collections.OrderedDict()
+        self.lock = threading.RLock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.current = None
+
+    def load(self, name):
+        """Create and fully load the named context"""
+        log.info("Loading context %s", name)
+        return self.factory(name).preload()
+
+    def get(self, name):
+        """Get the loaded context for name, loading it now if necessary"""
+        with self.lock:
+            future = self.contexts.get(name)
+            if future is not None and future.cancel():
+                # queued behind other preloads, load it here instead
+                future = None
+            owner = future is None
+            if owner:
+                future = self.contexts[name] = Future()
+            self.contexts.move_to_end(name)
+            self.current = name
+            evicted = self.evict()
+        self.close_all(evicted)
+        if owner:
+            try:
+                future.set_result(self.load(name))
+            except Exception as err:
+                future.set_exception(err)
+                self.discard_failed(name, future)
+        return future.result()
+
+    def preload(self, names):
+        """Start loading any of names which are not yet in the pool"""
+        with self.lock:
+            for name in names:
+                if name in self.contexts:
+                    continue
+                future = self.contexts[name] = self.executor.submit(self.load, name)
+                future.add_done_callback(functools.partial(self.discard_failed, name))
+            evicted = self.evict()
+        self.close_all(evicted)
+
+    def discard_failed(self, name, future):
+        """Remove a failed load from the pool so that it can be retried"""
+        if future.cancelled() or future.exception() is not None:
+            with self.lock:
+                if self.contexts.get(name) is future:
+                    del self.contexts[name]
+
+    def evict(self):
+        """Remove least-recently-used contexts over our size (never current)"""
+        evicted = []
+        for name in list(self.contexts):
+            if len(self.contexts) <= self.size:
+                break
+            if name != self.current:
+                log.info("Evicting context %s", name)
+                evicted.append(self.contexts.pop(name))
+        return evicted
+
+    def close_all(self, futures):
+        for future in futures:
+            if not future.cancel():
+                future.add_done_callback(close_loaded)
+
+
+def close_loaded(future):
+    """Close the context loaded by future (if it loaded)"""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
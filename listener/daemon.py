@@ -13,77 +13,109 @@ is to pipe the import from alsa through ffmpeg into the named pipe.
 clients may onto the events unix socket in the same directory
 to receive the partial and final event json records.
 """
-import logging, os, socket, collections, time, threading
-from deepspeech import Model
+import logging, os, socket, collections, time, threading, itertools
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import webrtcvad
 from . import eventserver
 from . import defaults
-from .ringbuffer import RingBuffer
+from .ringbuffer import RingBuffer, OVERFLOW_SPLIT, OVERFLOW_POLICIES
 
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 # How long of leading silence causes it to be discarded?
 FRAME_SIZE = (defaults.SAMPLE_RATE // 1000) * 20  # rate of 16000, so 16samples/ms
 SILENCE_FRAMES = 10  # in 20ms frames
+# Errors which indicate that the audio source went away
+DISCONNECT_ERRORS = (
+    webrtcvad._webrtcvad.Error,  # pylint: disable=protected-access
+    IOError,
+)
+# Target seconds between partial (intermediate) results
+PARTIAL_LATENCY = 0.25
+# Frames of audio before a stable word's start to keep when restarting
+COMMIT_LEAD_IN = 2
+# Duration of silence decoded to warm up a newly loaded model
+WARMUP_DURATION = 0.5
 
+# Process-wide registry of loaded models, see get_model()
+_MODELS = {}
+_MODELS_LOCK = threading.Lock()
+# (path, beam_width, scorer): {'load_time': seconds, 'warmup_time': seconds}
+MODEL_METRICS = {}
 
-def metadata_to_json(metadata, partial=False):
-    """Convert DeepSpeech Metadata struct to a json-compatible format"""
+
+# Per-token timing tables which are only needed for final events
+TIMING_KEYS = ('tokens', 'starts', 'word_starts')
+
+
+def metadata_to_json(metadata, partial=False, timing=True):
+    """Convert DeepSpeech Metadata struct to a json-compatible format
+
+    timing -- if False, omit the per-token timing tables (see TIMING_KEYS)
+    """
     struct = {
         'partial': partial,
         'final': not partial,
-        'transcripts': [],
+        'transcripts': [
+            transcript_to_json(transcript, partial=partial, timing=timing)
+            for transcript in metadata.transcripts
+        ],
     }
     if not partial:
         struct['utterance_number'] = int(time.time())
-
-    for transcript in metadata.transcripts:
-        struct['transcripts'].append(transcript_to_json(transcript))
     return struct
 
 
-def transcript_to_json(transcript, partial=False):
-    """Convert DeepSpeech Transcript struct to a json-compatible format"""
+def transcript_to_json(transcript, partial=False, timing=True):
+    """Convert DeepSpeech Transcript struct to a json-compatible format
+
+    timing -- if False, omit the per-token timing tables (see TIMING_KEYS)
+    """
+    tokens = [token.text for token in transcript.tokens]
+    text = ''.join(tokens)
     struct = {
         'partial': partial,
         'final': not partial,
-        'tokens': [],
-        'starts': [],
-        'words': [],
-        'word_starts': [],
+        'words': text.split(' '),
         'confidence': transcript.confidence,
+        'text': text,
     }
-    text = []
-    word = []
-    starts = 0.0
-    in_word = False
-    for token in transcript.tokens:
-        struct['tokens'].append(token.text)
-        text.append(token.text)
-        struct['starts'].append(token.start_time)
-
-        if token.text == ' ':
-            if word:
-                struct['words'].append(''.join(word))
-            in_word = False
-            del word[:]
-        else:
-            if not in_word:
-                struct['word_starts'].append(token.start_time)
-            in_word = True
-            word.append(token.text)
-    if word:
-        struct['words'].append(''.join(word))
-    struct['text'] = ''.join(text)
+    if '' in struct['words']:
+        struct['words'] = [word for word in struct['words'] if word]
+    if timing:
+        starts = [token.start_time for token in transcript.tokens]
+        struct['tokens'] = tokens
+        struct['starts'] = starts
+        struct['word_starts'] = [
+            start
+            for token, previous, start in zip(tokens, [' '] + tokens, starts)
+            if token != ' ' and previous == ' '
+        ]
     return struct
 
 
+def without_timing(metadata):
+    """Copy metadata without the per-token timing tables (see TIMING_KEYS)"""
+    result = dict(metadata)
+    result['transcripts'] = [
+        dict(
+            (key, value) for key, value in transcript.items() if key not in TIMING_KEYS
+        )
+        for transcript in metadata['transcripts']
+    ]
+    return result
+
+
 def produce_voice_runs(
     connection,
     read_frames=2,
     rate=defaults.SAMPLE_RATE,
     silence=SILENCE_FRAMES,
     voice_detect_aggression=3,
+    overflow=OVERFLOW_SPLIT,
+    annotate=False,
+    ring=None,
 ):
     """Produce runs of audio with voice detected
     
@@ -94,6 +126,13 @@ def produce_voice_runs(
     rate -- sample rate, 16KHz required for DeepSpeech
     silence -- number of audio frames that constitute a "pause" at which
                we should produce a new utterance
+    overflow -- ringbuffer policy for utterances longer than the buffer,
+                with the default split policy the utterance is ended
+                and a new one started, so no audio is dropped
+    annotate -- if True, yield (frame, is_speech) rather than frames, where
+                is_speech is False for lead-in and trailing silence
+    ring -- if specified, the RingBuffer to read into, otherwise we
+            create one, the first frame of each utterance is at ring.start
     
     Notes:
 
@@ -101,54 +140,66 @@ def produce_voice_runs(
           as we are working with noisy/messy environments
         * the start-of-voice event often is preceded by a bit of 
           lower-than-threshold "silence" which is critical for catching
-          the first word
+          the first word, that lead-in is replayed from the ring-buffer by
+          offset rather than being held as separate copies
         * we are using a static ringbuffer so that the main audio buffer shouldn't
-          wind up being copied
+          wind up being copied, the frames produced are views into that buffer
+          and are only valid until the buffer wraps around
     
     yields audio frames in sequence from the input
     """
     vad = webrtcvad.Vad(voice_detect_aggression)
-    ring = RingBuffer(rate=rate)
+    if ring is None:
+        ring = RingBuffer(rate=rate, overflow=overflow)
 
-    silence_count = 0
+    # we start out "between" utterances
+    silence_count = silence
     read_size = read_frames * FRAME_SIZE
-    # set of frames that were not considered speech
-    # but that we might need to recognise the first
-    # word of an utterance, here (in 20ms frames)
-    silence_frames = collections.deque([], 10)
+    # frames that were not considered speech but that we might
+    # need to recognise the first word of an utterance are
+    # replayed from the ring-buffer by offset (in 20ms frames)
+    lead_in = SILENCE_FRAMES
     while True:
-        new_buffer = ring.read_in(connection, read_size)
-        if not len(new_buffer):
-            log.debug("Input disconnected")
+        if silence_count >= silence:
+            # between utterances the current record is just the lead-in
+            ring.start = ring.wrap(ring.write_head - lead_in * FRAME_SIZE)
+        position = ring.write_head
+        if not ring.read_in(connection, read_size):
+            log.info(
+                "Input disconnected after %s overruns and %s underruns",
+                ring.overruns,
+                ring.underruns,
+            )
             yield None
             silence_count = 0
             raise IOError('Input disconnect')
-        for start in range(0, len(new_buffer) - 1, FRAME_SIZE):
-            frame = new_buffer[start : start + FRAME_SIZE]
+        if ring.overflowed:
+            ring.overflowed = False
+            log.debug('[] (overflow)')
+            yield None
+        for frame in ring.iterframes(position, ring.write_head, FRAME_SIZE):
             if vad.is_speech(frame, rate):
-                if silence_count:
+                if silence_count >= silence:
                     # Update the ring-buffer to tell us where
-                    # the audio started... note: currently there
-                    # is no checking for longer-than-ring-buffer
-                    # duration speeches...
-                    ring.start = ring.write_head
+                    # the audio started, longer-than-ring-buffer
+                    # speeches are handled by the overflow policy
+                    replay = min(silence_count, lead_in) * FRAME_SIZE
+                    ring.start = ring.wrap(position - replay)
                     log.debug('<')
-                    for last in silence_frames:
-                        ring.start -= len(last)
-                        yield last
-                    ring.start = ring.start % ring.size
-                yield frame
+                    for last in ring.iterframes(ring.start, position, FRAME_SIZE):
+                        yield (last, False) if annotate else last
+                yield (frame, True) if annotate else frame
                 silence_count = 0
-                silence_frames.clear()
             else:
                 silence_count += 1
-                silence_frames.append(frame)
                 if silence_count == silence:
                     log.debug('[]')
                     yield None
                 elif silence_count < silence:
-                    yield frame
+                    # short pauses are part of the current utterance
+                    yield (frame, False) if annotate else frame
                     log.debug('? %s', silence_count)
+            position = ring.wrap(position + len(frame))
 
 
 def run_recognition(
@@ -157,7 +208,11 @@ def run_recognition(
     out_queue,
     read_size=320,
     rate=defaults.SAMPLE_RATE,
-    max_decode_rate=4,
+    partial_latency=PARTIAL_LATENCY,
+    overflow=OVERFLOW_SPLIT,
+    stream_id=None,
+    stable_partials=0,
+    partial_timing=False,
 ):
     """Read fragments from connection, write results to output
     
@@ -165,7 +220,14 @@ def run_recognition(
     connection -- input binary audio stream 16KHz mono 16-bit unsigned machine order audio
     output -- output (text) stream to which to write updates
     rate -- audio rate (16,000 to be compatible with DeepSpeech)
-    max_decode_rate -- maximum number of times/s to do partial recognition
+    partial_latency -- target seconds between partial recognitions, see
+                       PartialScheduler
+    overflow -- ringbuffer policy for longer-than-buffer utterances
+    stream_id -- if specified, tag each event with this stream_id so that
+                 clients can separate events from multiple audio sources
+    stable_partials -- if non-zero, the N for the prefix-stability commits
+                       described below (see iter_metadata)
+    partial_timing -- if True, include per-token timing in partial events
 
     As incoming data comes in, accumulate in a (ring)
     buffer. As partial recognitions are run, look for
@@ -177,37 +239,237 @@ def run_recognition(
     last word was the start of the utterance
     """
     # create our ring-buffer structure with 60s of audio
-    for metadata in iter_metadata(model, connection=connection, rate=rate):
+    for metadata in iter_metadata(
+        model,
+        connection=connection,
+        rate=rate,
+        partial_latency=partial_latency,
+        overflow=overflow,
+        stable_partials=stable_partials,
+        partial_timing=partial_timing,
+    ):
+        if stream_id is not None:
+            metadata['stream_id'] = stream_id
         out_queue.put(metadata)
 
 
-def iter_metadata(model, connection, rate=defaults.SAMPLE_RATE, max_decode_rate=4):
-    """Iterate over connection producing transcriptions with model"""
+class PartialScheduler(object):
+    """Decides when to run partial (intermediate) decodes
+
+    Each partial decode re-decodes the whole utterance so far, so the
+    cost of a decode grows with the utterance. We track the (smoothed)
+    cost of the decodes and space them out so that decoding uses at most
+    1/headroom of real time, backing off further whenever a decode takes
+    longer than the audio it covered. Decodes are never scheduled more
+    often than target_latency, and are skipped entirely when no new
+    speech has arrived since the last one.
+
+    target_latency -- desired seconds between partial results, <= 0 disables
+    max_latency -- longest we will back off between partial results
+    """
+
+    def __init__(
+        self,
+        rate=defaults.SAMPLE_RATE,
+        target_latency=PARTIAL_LATENCY,
+        max_latency=2.0,
+        headroom=2.0,
+        smoothing=0.3,
+    ):
+        self.rate = rate
+        self.target_latency = target_latency
+        self.max_latency = max(max_latency, target_latency)
+        self.headroom = headroom
+        self.smoothing = smoothing
+        self.reset()
+
+    def reset(self, length=0):
+        """Start scheduling for a new utterance (or restarted stream of length)"""
+        self.length = length
+        self.last_decode = length
+        self.new_speech = False
+        self.cost = None
+        self.interval = self.target_latency
+
+    def feed(self, samples, is_speech=True):
+        """Record that samples have been fed to the stream"""
+        self.length += samples
+        if is_speech:
+            self.new_speech = True
+
+    def due(self):
+        """Should we run a partial decode now?"""
+        if self.target_latency <= 0 or not self.new_speech:
+            return False
+        return (self.length - self.last_decode) >= self.interval * self.rate
+
+    def decoded(self, duration):
+        """Record that a partial decode took duration seconds"""
+        elapsed = (self.length - self.last_decode) / self.rate
+        if self.cost is None:
+            self.cost = duration
+        else:
+            self.cost += (duration - self.cost) * self.smoothing
+        self.last_decode = self.length
+        self.new_speech = False
+        if duration > elapsed:
+            # slower than real time, back off until we catch up
+            self.interval = min(self.interval * 2, self.max_latency)
+        else:
+            self.interval = min(
+                max(self.target_latency, self.cost * self.headroom), self.max_latency
+            )
+
+
+def stable_prefix(word_lists):
+    """Find the words which are common to the start of all word_lists"""
+    if not word_lists:
+        return []
+    first = word_lists[0]
+    count = min(len(words) for words in word_lists)
+    for i in range(count):
+        if any(words[i] != first[i] for words in word_lists):
+            return first[:i]
+    return first[:count]
+
+
+def commit_to_json(transcript, count, restart):
+    """Create a final event for the first count words of a partial transcript
+
+    restart -- stream time (seconds) at which the uncommitted words start
+    """
+    tokens = [
+        (token, start)
+        for token, start in zip(transcript['tokens'], transcript['starts'])
+        if start < restart
+    ]
+    words = transcript['words'][:count]
+    return {
+        'partial': False,
+        'final': True,
+        'utterance_number': int(time.time()),
+        'transcripts': [
+            {
+                'partial': False,
+                'final': True,
+                'tokens': [token for token, _ in tokens],
+                'starts': [start for _, start in tokens],
+                'words': words,
+                'word_starts': transcript['word_starts'][:count],
+                'confidence': transcript['confidence'],
+                'text': ' '.join(words),
+            }
+        ],
+    }
+
+
+def iter_metadata(
+    model,
+    connection,
+    rate=defaults.SAMPLE_RATE,
+    partial_latency=PARTIAL_LATENCY,
+    overflow=OVERFLOW_SPLIT,
+    stable_partials=0,
+    partial_timing=False,
+):
+    """Iterate over connection producing transcriptions with model
+
+    stable_partials -- if non-zero, when the top transcript of this many
+                       consecutive partials agree on a prefix of two or more
+                       words, the words before the last stable word are
+                       yielded as a final event and the stream is restarted
+                       from the start of the last stable word, so that
+                       decode cost stays flat for long utterances
+    partial_timing -- if True, include the per-token timing tables in partial
+                      events, normally they are only produced for finals
+    """
+    ring = RingBuffer(rate=rate, overflow=overflow)
     stream = model.createStream()
-    length = last_decode = 0
-    for new_buffer in produce_voice_runs(connection, rate=rate,):
-        if new_buffer is None:
-            if length:
+    scheduler = PartialScheduler(rate=rate, target_latency=partial_latency)
+    history = collections.deque([], stable_partials or 1)
+    stream_start = ring.start
+    # arrival of the latest speech frame, so the audio->vad stage is the
+    # time taken to detect the end of speech, not the utterance duration
+    speech_end = time.monotonic()
+    for run in produce_voice_runs(
+        connection, rate=rate, annotate=True, ring=ring,
+    ):
+        if run is None:
+            if scheduler.length:
+                vad_end = time.monotonic()
                 metadata = metadata_to_json(
                     stream.finishStreamWithMetadata(15), partial=False
                 )
+                metadata['timings'] = {
+                    'audio': speech_end,
+                    'vad': vad_end,
+                    'decoded': time.monotonic(),
+                }
                 for tran in metadata['transcripts']:
                     log.info(">>> %0.02f %s", tran['confidence'], tran['words'])
                 yield metadata
                 stream = model.createStream()
-                length = last_decode = 0
+                scheduler.reset()
+                history.clear()
         else:
-            stream.feedAudioContent(new_buffer)
-            written = len(new_buffer)
-            length += written
-            if (length - last_decode) > rate // max_decode_rate:
+            frame, is_speech = run
+            if not scheduler.length:
+                # first frame of an utterance is always at ring.start
+                stream_start = ring.start
+                speech_end = time.monotonic()
+            if is_speech:
+                speech_end = time.monotonic()
+            stream.feedAudioContent(frame)
+            scheduler.feed(len(frame), is_speech)
+            if scheduler.due():
+                started = time.monotonic()
+                decoded = stream.intermediateDecodeWithMetadata()
+                scheduler.decoded(time.monotonic() - started)
+                # the stability commits need the timing even if clients do not
                 metadata = metadata_to_json(
-                    stream.intermediateDecodeWithMetadata(), partial=True
+                    decoded,
+                    partial=True,
+                    timing=bool(stable_partials) or partial_timing,
                 )
+                metadata['timings'] = {
+                    'audio': speech_end,
+                    'decoded': time.monotonic(),
+                }
                 if metadata['transcripts'][0]['text']:
-                    yield metadata
-                words = metadata['transcripts'][0]['words']
-                log.info("... %s", ' '.join(words))
+                    if stable_partials and not partial_timing:
+                        yield without_timing(metadata)
+                    else:
+                        yield metadata
+                top = metadata['transcripts'][0]
+                log.info("... %s", ' '.join(top['words']))
+                if not stable_partials:
+                    continue
+                history.append(top['words'])
+                if len(history) < stable_partials:
+                    continue
+                stable = stable_prefix(history)
+                if len(stable) < 2:
+                    continue
+                # restart the stream from the start of the last stable word
+                count = len(stable) - 1
+                restart = top['word_starts'][count]
+                offset = (
+                    stream_start + int(restart * rate) - COMMIT_LEAD_IN * FRAME_SIZE
+                )
+                fed = ring.wrap(stream_start + scheduler.length)
+                replay = ring.distance(offset, fed)
+                if replay >= scheduler.length:
+                    continue
+                log.info("=== %s", ' '.join(stable[:count]))
+                committed = commit_to_json(top, count, restart)
+                committed['timings'] = dict(metadata['timings'])
+                yield committed
+                ring.start = stream_start = ring.wrap(offset)
+                stream = model.createStream()
+                for segment in ring.itercurrent(stop=fed):
+                    stream.feedAudioContent(segment)
+                scheduler.reset(replay)
+                history.clear()
 
 
 def open_fifo(filename, mode='rb'):
@@ -227,6 +489,17 @@ def create_input_socket(port):
     return sock
 
 
+def create_unix_input_socket(sockname, backlog=5):
+    """Create a unix socket on which audio sources can connect"""
+    if os.path.exists(sockname):
+        os.remove(sockname)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.setblocking(True)
+    sock.bind(sockname)
+    sock.listen(backlog)
+    return sock
+
+
 def get_options():
     """Construct the argument parser for the command line"""
     import argparse  # pylint: disable=import-outside-toplevel
@@ -253,6 +526,64 @@ def get_options():
         type=int,
         help='If specified, override the model default beam width',
     )
+    parser.add_argument(
+        '--scorer',
+        default=None,
+        help='If specified, enable this external scorer (by default the '
+        'built-in scorer is disabled)',
+    )
+    parser.add_argument(
+        '--partial-latency',
+        default=PARTIAL_LATENCY,
+        type=float,
+        help='Target seconds between partial results, decoding backs off '
+        'from this when partial decodes are slower than real time, '
+        '0 disables partial results (default: %s)' % (PARTIAL_LATENCY,),
+    )
+    parser.add_argument(
+        '--stable-partials',
+        default=0,
+        type=int,
+        help='If non-zero, commit words that are stable across this many '
+        'partial results as final results and restart decoding after them, '
+        'keeping decode cost flat for long utterances (default: disabled)',
+    )
+    parser.add_argument(
+        '--partial-timing',
+        default=False,
+        action='store_true',
+        help='Include per-token timing in partial results (normally only '
+        'final results include timing)',
+    )
+    parser.add_argument(
+        '--overflow',
+        default=OVERFLOW_SPLIT,
+        choices=OVERFLOW_POLICIES,
+        help='How to handle utterances longer than the (30s) audio buffer, '
+        'split ends the utterance and starts a new one, drop-oldest keeps '
+        'the utterance going but cannot replay its oldest audio (default: %s)'
+        % (OVERFLOW_SPLIT,),
+    )
+    parser.add_argument(
+        '--streams',
+        default=4,
+        type=int,
+        help='Maximum number of concurrent audio sources in multi-stream mode '
+        '(--unix-socket or --fifo-dir), each is run on a worker pool sharing '
+        'a single loaded model (default: 4)',
+    )
+    parser.add_argument(
+        '--unix-socket',
+        default=None,
+        help='If specified, run in multi-stream mode accepting audio sources '
+        'on this unix socket',
+    )
+    parser.add_argument(
+        '--fifo-dir',
+        default=None,
+        help='If specified, run in multi-stream mode creating --streams fifos '
+        '(audio-0, audio-1, ...) in this directory',
+    )
     parser.add_argument(
         '--port',
         default=None,
@@ -269,37 +600,209 @@ def get_options():
     return parser
 
 
-def process_input_file(conn, options, out_queue, background=True):
-    """Given socket/pipe process audio input and push to out_queue"""
-    log.info("Starting recognition on %s", conn)
-    model = Model(options.model,)
-    if options.beam_width:
-        model.setBeamWidth(options.beam_width)
+def model_key(options):
+    """Get the model registry key for the model configured in options"""
+    return (options.model, options.beam_width, options.scorer)
+
+
+def load_model(options):
+    """Get the (shared) DeepSpeech model configured in options"""
+    return get_model(*model_key(options))
+
+
+def get_model(path, beam_width=None, scorer=None):
+    """Get the DeepSpeech model for the given configuration
+
+    Models are loaded (and warmed up) once per process and then
+    reused by every connection, so a reconnecting audio source
+    does not pay for the model load again.
+    """
+    key = (path, beam_width, scorer)
+    with _MODELS_LOCK:
+        model = _MODELS.get(key)
+        if model is None:
+            model = _MODELS[key] = _load_model(path, beam_width, scorer)
+    return model
+
+
+def _load_model(path, beam_width=None, scorer=None):
+    """Load and warm up a model, recording timing in MODEL_METRICS"""
+    # imported here so the audio pipeline can be used (e.g. benchmarked)
+    # without the DeepSpeech runtime installed
+    from deepspeech import Model
+
+    log.info("Loading model %s", path)
+    started = time.monotonic()
+    model = Model(path,)
+    if beam_width:
+        model.setBeamWidth(beam_width)
     desired_sample_rate = model.sampleRate()
     if desired_sample_rate != defaults.SAMPLE_RATE:
         log.error("Model expects rate of %s", desired_sample_rate)
-    # if options.scorer:
-    #     model.enableExternalScorer(options.scorer)
-    # else:
-    log.info("Disabling the built-in scorer")
-    model.disableExternalScorer()
-    out_queue.put({'partial': False, 'final': False, 'message': ['Connected']})
+    if scorer:
+        log.info("Enabling the external scorer %s", scorer)
+        model.enableExternalScorer(scorer)
+    else:
+        log.info("Disabling the built-in scorer")
+        model.disableExternalScorer()
+    loaded = time.monotonic()
+    warm_up(model)
+    metrics = MODEL_METRICS[(path, beam_width, scorer)] = {
+        'load_time': loaded - started,
+        'warmup_time': time.monotonic() - loaded,
+    }
+    log.info(
+        "Model %s loaded in %0.2fs (warm-up %0.2fs)",
+        path,
+        metrics['load_time'],
+        metrics['warmup_time'],
+    )
+    return model
+
+
+def warm_up(model, duration=WARMUP_DURATION):
+    """Decode a short run of silence so that model problems show up at startup
+
+    This also means lazy initialisation in the backend is paid for
+    before the first real utterance rather than during it.
+    """
+    stream = model.createStream()
+    stream.feedAudioContent(
+        np.zeros((int(model.sampleRate() * duration),), dtype=np.int16)
+    )
+    stream.finishStream()
+
+
+def process_input_file(
+    conn, options, out_queue, background=True, model=None, stream_id=None
+):
+    """Given socket/pipe process audio input and push to out_queue
+
+    model -- if specified, a loaded model to share, otherwise load from options
+    stream_id -- if specified, tag events from this source with the stream_id
+    """
+    log.info("Starting recognition on %s", conn)
+    if model is None:
+        model = load_model(options)
+    messages = ['Connected']
+    metrics = MODEL_METRICS.get(model_key(options))
+    if metrics:
+        messages.append(
+            'Model loaded in %(load_time)0.2fs (warm-up %(warmup_time)0.2fs)' % metrics
+        )
+    message = {'partial': False, 'final': False, 'messages': messages}
+    if stream_id is not None:
+        message['stream_id'] = stream_id
+    out_queue.put(message)
+    kwargs = dict(
+        partial_latency=options.partial_latency,
+        overflow=options.overflow,
+        stream_id=stream_id,
+        stable_partials=options.stable_partials,
+        partial_timing=options.partial_timing,
+    )
     if background:
-        thread = threading.Thread(target=run_recognition, args=(model, conn, out_queue))
+        thread = threading.Thread(
+            target=run_recognition, args=(model, conn, out_queue), kwargs=kwargs,
+        )
         thread.setDaemon(background)
         thread.start()
     else:
-        run_recognition(model, conn, out_queue)
+        run_recognition(model, conn, out_queue, **kwargs)
+
+
+@defaults.log_on_fail(log)
+def serve_connection(conn, model, options, out_queue, stream_id, slots):
+    """Run recognition for a single multi-stream client until it disconnects"""
+    try:
+        process_input_file(
+            conn,
+            options,
+            out_queue,
+            background=False,
+            model=model,
+            stream_id=stream_id,
+        )
+    except DISCONNECT_ERRORS:
+        log.info("Stream %s disconnected", stream_id)
+    finally:
+        conn.close()
+        slots.release()
+
+
+@defaults.log_on_fail(log)
+def serve_fifo(filename, model, options, out_queue, stream_id):
+    """Run recognition for a multi-stream fifo, re-opening it on disconnect"""
+    while True:
+        try:
+            with open_fifo(filename) as conn:
+                log.info("FIFO %s connected, processing", filename)
+                process_input_file(
+                    conn,
+                    options,
+                    out_queue,
+                    background=False,
+                    model=model,
+                    stream_id=stream_id,
+                )
+        except DISCONNECT_ERRORS:
+            log.info("Disconnect on %s, re-opening fifo", filename)
+            time.sleep(2.0)
+
+
+def serve_streams(options, out_queue):
+    """Serve multiple concurrent audio sources from a single process
+
+    The model is loaded once and shared, each audio source gets its
+    own DeepSpeech stream (and ringbuffer) run on a bounded worker
+    pool of options.streams threads.
+
+    With --fifo-dir each worker owns one fifo in the directory, with
+    --unix-socket we stop accepting new sources while all of the
+    workers are busy (clients wait in the listen backlog).
+    """
+    model = load_model(options)
+    pool = ThreadPoolExecutor(max_workers=options.streams)
+    if options.fifo_dir:
+        if not os.path.exists(options.fifo_dir):
+            os.makedirs(options.fifo_dir, 0o700)
+        for i in range(options.streams):
+            stream_id = 'audio-%s' % (i,)
+            filename = os.path.join(options.fifo_dir, stream_id)
+            log.info("Send Raw, Mono, 16KHz, s16le, audio to %s", filename)
+            pool.submit(serve_fifo, filename, model, options, out_queue, stream_id)
+        pool.shutdown(wait=True)
+    else:
+        sock = create_unix_input_socket(options.unix_socket, backlog=options.streams)
+        log.info("Send Raw, Mono, 16KHz, s16le, audio to %s", options.unix_socket)
+        slots = threading.BoundedSemaphore(options.streams)
+        for stream_number in itertools.count():
+            if not slots.acquire(blocking=False):
+                log.warning(
+                    "All %s streams busy, waiting for a free worker", options.streams
+                )
+                slots.acquire()
+            conn, _ = sock.accept()
+            stream_id = 'stream-%s' % (stream_number,)
+            log.info("Accepted %s as %s", conn, stream_id)
+            pool.submit(
+                serve_connection, conn, model, options, out_queue, stream_id, slots
+            )
 
 
 def main():
     """Main deepspeech daemon process"""
     options = get_options().parse_args()
     defaults.setup_logging(options)
-    log.info("Send Raw, Mono, 16KHz, s16le, audio to %s", options.input)
 
     out_queue = eventserver.create_sending_threads(options.output)
 
+    if options.unix_socket or options.fifo_dir:
+        serve_streams(options, out_queue)
+        return
+    # load up-front so that connections do not wait on the model
+    load_model(options)
+    log.info("Send Raw, Mono, 16KHz, s16le, audio to %s", options.input)
     if options.port:
         sock = create_input_socket(options.port)
         while True:
@@ -313,10 +816,7 @@ def main():
                 sock = open_fifo(options.input)
                 log.info("FIFO connected, processing")
                 process_input_file(sock, options, out_queue, background=False)
-            except (
-                webrtcvad._webrtcvad.Error,
-                IOError,
-            ):  # pylint: disable=protected-access
+            except DISCONNECT_ERRORS:
                 log.info("Disconnect, re-opening fifo")
                 time.sleep(2.0)
 
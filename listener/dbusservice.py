@@ -45,7 +45,8 @@ import dbus
 import dbus.service
 
 IBus.init()
-from . import eventreceiver, interpreter, defaults, models, ibusengine
+from . import eventreceiver, interpreter, defaults, models, ibusengine, latency
+from . import uinputdriver
 
 log = logging.getLogger(__name__)
 
@@ -139,6 +140,7 @@ class ListenerService(dbus.service.Object):
         bus_name = dbus.service.BusName(self.DBUS_NAME, bus=dbus.SessionBus())
         dbus.service.Object.__init__(self, bus_name, self.DBUS_PATH)
         self.contexts = {}
+        self.latency = latency.LatencyTracker()
         self.current_context_name = 'english-python'
         self.SetContext(self.current_context_name)
         self.interpreter = InterpreterService(self)
@@ -209,6 +211,30 @@ class ListenerService(dbus.service.Object):
 
         return sorted(models.ContextDefinition.context_names())
 
+    @dbus.service.method(DBUS_NAME, in_signature='', out_signature='a{sa{sd}}')
+    def GetLatencyStats(self):
+        """Get the per-stage latency (seconds) of final utterances
+
+        Stages are described in listener.latency, each gives
+        count, mean, p50, p99 and max.
+        """
+        return self.latency.stats()
+
+    @dbus.service.method(DBUS_NAME, in_signature='s', out_signature='')
+    def TypeText(self, content):
+        """Type content (see UInput.parse_input_string) on the virtual keyboard
+
+        Typing happens on the session's worker and is shared with our
+        interpreter, so the "stop typing" command (in the typing rules)
+        can interrupt it.
+        """
+        uinputdriver.get_session().type(content)
+
+    @dbus.service.method(DBUS_NAME, in_signature='', out_signature='')
+    def StopTyping(self):
+        """Abandon any text still being typed on the virtual keyboard"""
+        uinputdriver.cancel_typing()
+
     # @dbus.service.method(DBUS_NAME,)
     # def contexts(self):
     #     """Lists the contexts currently defined in the service
@@ -241,6 +267,9 @@ class ListenerService(dbus.service.Object):
             if event.transcripts:
                 self.PartialResult(event.dbus_struct())
         elif event.final:
+            if ibus:
+                latency.stamp(event, 'committed')
+            self.latency.record(event)
             if event.transcripts:
                 self.FinalResult(event.dbus_struct())
 
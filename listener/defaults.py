@@ -66,6 +66,7 @@ MICROPHONE_ENABLED_KEY = 'audioview.enable_audio'
 DEFAULT_CONTEXT = 'english-python'
 STOPPED_CONTEXT = 'english-stopped'
 SPELLING_CONTEXT = 'english-spelling'
+TYPING_CONTEXT = 'english-typing'
 
 
 def setup_logging(options, filename=None):
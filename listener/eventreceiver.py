@@ -1,6 +1,6 @@
 """Simple iterative reading of an open socket to produce events"""
-import socket, logging, time, json, select, os
-from . import defaults, models
+import socket, logging, os, asyncio
+from . import defaults, models, protocol, latency
 
 log = logging.getLogger(__name__)
 
@@ -37,48 +37,81 @@ def create_client_socket(sockname):
     return sock
 
 
-def read_thread(callback, sockname=DEFAULT_SOCKET):
+def read_thread(callback, sockname=DEFAULT_SOCKET, format=None):
     """Utility to run callback on each read event from sockname"""
-    for event in read_from_socket(sockname):
+    for event in read_from_socket(sockname, format=format):
         callback(event)
 
 
 def read_from_socket(
-    sockname=DEFAULT_SOCKET, connect_backoff=2.0,
+    sockname=DEFAULT_SOCKET, connect_backoff=2.0, format=None,
 ):
+    """Iterate over the Utterances arriving on sockname, reconnecting as needed
+
+    Runs async_read_from_socket in a private event loop, so this
+    blocks until each event arrives rather than polling.
+    """
+    loop = asyncio.new_event_loop()
+    events = async_read_from_socket(
+        sockname=sockname, connect_backoff=connect_backoff, format=format,
+    )
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(events.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(events.aclose())
+        loop.close()
+
+
+async def async_read_from_socket(
+    sockname=DEFAULT_SOCKET, connect_backoff=2.0, format=None,
+):
+    """Asynchronously iterate over the Utterances arriving on sockname
+
+    format -- framed body format to request (see protocol), by default the
+              best one available, protocol.LEGACY for NUL-terminated json
+    """
+    if format is None:
+        format = protocol.preferred_format()
+    loop = asyncio.get_event_loop()
     while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.setblocking(False)
         try:
             log.debug("Opening event socket: %s", sockname)
-            sock = create_client_socket(sockname)
+            await loop.sock_connect(sock, sockname)
         except FileNotFoundError as err:
+            sock.close()
             log.info("Upstream source has not created: %s", sockname)
-            time.sleep(connect_backoff)
+            await asyncio.sleep(connect_backoff)
+            continue
         except Exception as err:
-            log.exception("Unable to connect to event source")
-            time.sleep(connect_backoff)
-        else:
-            log.debug("Waiting for events on %s", sock)
-            read_set = [sock]
-            try:
-                content = b''
-                while True:
-                    readable, _, _ = select.select(read_set, [], [], 2)
-                    if readable:
-                        update = sock.recv(256)
-                    else:
-                        continue
-                    if not update:
-                        log.debug("Socket seems to have closed")
-                        break
-                    content += update
-                    while b'\000' in content:
-                        message, content = content.split(b'\000', 1)
-                        decoded = json.loads(message)
-                        yield models.Utterance(**decoded)
-            finally:
-                log.info("Closing %s", sockname)
-                sock.close()
-                time.sleep(connect_backoff)
+            sock.close()
+            log.exception("Unable to connect to event source: %s", sockname)
+            await asyncio.sleep(connect_backoff)
+            continue
+        log.debug("Waiting for events on %s", sockname)
+        try:
+            frames = protocol.FrameReader(format)
+            if format != protocol.LEGACY:
+                await loop.sock_sendall(sock, protocol.encode_hello(format))
+            while True:
+                # receive straight into the reader's buffer, no intermediate bytes
+                with frames.free_space() as view:
+                    count = await loop.sock_recv_into(sock, view)
+                if not count:
+                    log.debug("Socket seems to have closed")
+                    break
+                frames.wrote(count)
+                for decoded in frames:
+                    yield latency.stamp(models.Utterance(**decoded), 'received')
+        finally:
+            log.info("Closing %s", sockname)
+            sock.close()
+        await asyncio.sleep(connect_backoff)
 
 
 def get_options():
@@ -1,23 +1,71 @@
 """Event sending common code"""
-import socket, queue, threading, logging, os, json
+import socket, threading, logging, os, time, collections, asyncio
+from . import protocol, latency
 
 log = logging.getLogger(__name__)
 
+# Compact (whitespace-free) json encoding
+SEPARATORS = (',', ':')
+# Utterance fields which cannot/should not be sent to clients
+UTTERANCE_EXCLUDE = {'transcripts': {'__all__': {'rule_matches'}}}
+# partials also drop the per-token timing, which nobody reads
+PARTIAL_EXCLUDE = {
+    'transcripts': {'__all__': {'rule_matches', 'tokens', 'starts', 'word_starts'}}
+}
+# How long a new client has to request framing before we fall back to legacy
+HELLO_TIMEOUT = 0.5
+# Events waiting for a client before partials start being dropped
+CLIENT_QUEUE_SIZE = 64
+# Seconds a client may fall behind before it is disconnected
+CLIENT_LAG_LIMIT = 5.0
+
+
+class EventQueue(object):
+    """Thread-safe handle used to put events onto an EventServer
+
+    Has the put() method of the queue.Queue previously returned by
+    create_sending_threads, so producers in other threads are unchanged.
+    """
+
+    def __init__(self, server, loop):
+        self.server = server
+        self.loop = loop
+
+    def put(self, record):
+        self.loop.call_soon_threadsafe(self.server.send, record)
+
 
 def create_sending_threads(sockname='/tmp/dspipe/events'):
-    """Create a simple threaded server serving events at sockname"""
-    outputs = []
-    out_queue = queue.Queue()
-    t = threading.Thread(target=write_queue, args=(out_queue, outputs))
-    t.setDaemon(True)
-    t.start()
+    """Create a simple server serving events at sockname
 
+    All clients are served from a single asyncio loop running in
+    a (daemon) thread, returns an EventQueue to put events onto.
+    """
+    loop = asyncio.new_event_loop()
+    server = EventServer(sockname)
     sock = create_output_socket(sockname)
-    t = threading.Thread(target=output_thread, args=(sock, outputs))
+    t = threading.Thread(target=run_server, args=(loop, server, sock))
     t.setDaemon(True)
     t.start()
+    return EventQueue(server, loop)
+
+
+def run_server(loop, server, sock):
+    """Run server in loop (in the current thread) forever"""
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(server.start(sock=sock))
+    loop.run_forever()
+
 
-    return out_queue
+async def serve_events(sockname='/tmp/dspipe/events'):
+    """Start serving events at sockname in the running loop
+
+    returns the EventServer, call send() on it (from the loop) to
+    send an event to all clients
+    """
+    server = EventServer(sockname)
+    await server.start()
+    return server
 
 
 def create_output_socket(sockname):
@@ -29,39 +77,232 @@ def create_output_socket(sockname):
     return sock
 
 
-def output_thread(sock, outputs):
-    sock.listen(1)
-    while True:
-        conn, addr = sock.accept()
-        log.info("Got a connection on %s", conn)
-        q = queue.Queue()
-        outputs.append(q)
-        threading.Thread(target=out_writer, args=(conn, q, outputs)).start()
-
-
-def write_queue(queue, outputs):
-    """run the write queue"""
-    while True:
-        record = queue.get()
-        if hasattr(record, 'json'):
-            for transcript in record.transcripts:
-                transcript.rule_matches = []
-            encoded = record.json(exclude={'rule_matches'}).encode('utf-8')
-        else:
-            encoded = json.dumps(record).encode('utf-8')
-        for output in outputs:
-            output.put(encoded)
+class EventServer(object):
+    """Fans out events to every client connected to sockname"""
+
+    def __init__(
+        self, sockname, size=CLIENT_QUEUE_SIZE, lag_limit=CLIENT_LAG_LIMIT,
+    ):
+        self.sockname = sockname
+        self.size = size
+        self.lag_limit = lag_limit
+        self.clients = []
+        self.server = None
+
+    async def start(self, sock=None):
+        """Start accepting clients, on sock if given else a new socket"""
+        if sock is None:
+            sock = create_output_socket(self.sockname)
+        self.server = await asyncio.start_unix_server(self.serve_client, sock=sock)
+        return self
+
+    def close(self):
+        """Stop accepting clients and disconnect the current ones"""
+        if self.server is not None:
+            self.server.close()
+        for client in self.clients[:]:
+            client.close()
+
+    def send(self, record):
+        """Queue record for sending to all current clients"""
+        timings = record.get('timings') if isinstance(record, dict) else record.timings
+        if timings is not None and 'queued' not in timings:
+            latency.stamp(record, 'queued')
+        event = EncodedEvent(record)
+        for client in self.clients[:]:
+            client.put(event)
 
+    def stats(self):
+        """Give the sending statistics for each current client"""
+        return [client.stats() for client in self.clients]
 
-def out_writer(conn, q, outputs):
-    """Trivial thread to write events to the client"""
-    while True:
+    async def serve_client(self, reader, writer):
+        """Write events to a single client until it disconnects"""
+        log.info("Got a connection on %s", self.sockname)
+        client = ClientQueue(writer, size=self.size, lag_limit=self.lag_limit)
+        self.clients.append(client)
         try:
-            content = q.get()
-            conn.sendall(content)
-            conn.sendall(b'\000')
+            format = await negotiate(reader, writer)
+            while True:
+                event = await client.get()
+                if event is None:
+                    break
+                writer.writelines(event.encoded(format))
+                await writer.drain()
+                client.task_done()
         except Exception:
-            log.debug("Failed during send, closing this client: %s", conn)
-            conn.close()
-            break
-    outputs.remove(q)
+            log.debug("Failed during send, closing this client")
+        client.close()
+        writer.close()
+        log.info("Client disconnected: %s", client.stats())
+        self.clients.remove(client)
+
+
+def encode_event(record, format=protocol.LEGACY):
+    """Encode an Utterance or json-compatible dict as a message in format
+
+    LEGACY messages are NUL-terminated json, other formats are
+    framed with a protocol header.
+
+    returns a tuple of buffers to be sent (in one call) with writelines
+    """
+    if hasattr(record, 'json'):
+        exclude = PARTIAL_EXCLUDE if record.partial else UTTERANCE_EXCLUDE
+        if format == protocol.MSGPACK:
+            body = protocol.dumps(record.dict(exclude=exclude), format)
+        else:
+            body = record.json(exclude=exclude, separators=SEPARATORS).encode('utf-8')
+    else:
+        body = protocol.dumps(record, format)
+    if format == protocol.LEGACY:
+        return (body, protocol.TERMINATOR)
+    return (protocol.encode_header(format, len(body)), body)
+
+
+class EncodedEvent(object):
+    """An event shared by all clients, encoded once per format in use
+
+    Each event is encoded the first time a client using a given
+    format asks for it and the same bytes are then shared by all
+    of the connected clients using that format.
+    """
+
+    __slots__ = ('record', 'partial', 'encodings')
+
+    def __init__(self, record):
+        self.record = record
+        if hasattr(record, 'partial'):
+            self.partial = record.partial
+        else:
+            self.partial = record.get('partial', False)
+        self.encodings = {}
+
+    def encoded(self, format=protocol.LEGACY):
+        encoded = self.encodings.get(format)
+        if encoded is None:
+            encoded = self.encodings[format] = encode_event(self.record, format)
+        return encoded
+
+
+class ClientQueue(object):
+    """Bounded queue of events waiting to be sent to a single client
+
+    When the queue is full the oldest waiting partial is dropped to make
+    room (a newer partial will supersede it anyway), finals are never
+    dropped. A client whose oldest unsent event is more than lag_limit
+    seconds old is considered stalled and is disconnected.
+
+    Must only be used from the thread running the server's loop.
+    """
+
+    def __init__(self, writer, size=CLIENT_QUEUE_SIZE, lag_limit=CLIENT_LAG_LIMIT):
+        self.writer = writer
+        self.size = size
+        self.lag_limit = lag_limit
+        self.events = collections.deque()
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.sending = None
+        self.sent = 0
+        self.dropped = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    def __len__(self):
+        return len(self.events)
+
+    def behind(self, now=None):
+        """How many seconds the oldest unsent event has been waiting"""
+        now = now or time.monotonic()
+        if self.sending is not None:
+            return now - self.sending
+        if self.events:
+            return now - self.events[0][0]
+        return 0.0
+
+    def put(self, event):
+        """Queue event for sending, returns False if the client is gone"""
+        if self.closed:
+            return False
+        now = time.monotonic()
+        behind = self.behind(now)
+        if behind > self.lag_limit:
+            log.warning("Client is %0.1fs behind, disconnecting", behind)
+            self.close()
+            return False
+        if len(self.events) >= self.size and not self.drop_partial():
+            if event.partial:
+                self.dropped += 1
+                return True
+        self.events.append((now, event))
+        self.ready.set()
+        return True
+
+    def drop_partial(self):
+        """Drop the oldest waiting partial, returns whether one was dropped"""
+        for index, (_, event) in enumerate(self.events):
+            if event.partial:
+                del self.events[index]
+                self.dropped += 1
+                return True
+        return False
+
+    async def get(self):
+        """Wait for the next event to send, returns None once closed"""
+        while not self.events and not self.closed:
+            self.ready.clear()
+            await self.ready.wait()
+        if self.closed:
+            return None
+        self.sending, event = self.events.popleft()
+        return event
+
+    def task_done(self):
+        """Record that the event last returned by get has been sent"""
+        self.lag = time.monotonic() - self.sending
+        self.max_lag = max(self.lag, self.max_lag)
+        self.sending = None
+        self.sent += 1
+
+    def close(self):
+        """Stop queueing and abort any send in progress"""
+        if self.closed:
+            return
+        self.closed = True
+        self.events.clear()
+        self.ready.set()
+        self.writer.transport.abort()
+
+    def stats(self):
+        """Give the sending statistics for this client"""
+        return {
+            'queued': len(self.events),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'lag': self.lag,
+            'max_lag': self.max_lag,
+            'behind': self.behind(),
+        }
+
+
+async def negotiate(reader, writer, timeout=HELLO_TIMEOUT):
+    """Wait briefly for a client HELLO, returning the format to use"""
+    try:
+        content = await asyncio.wait_for(
+            reader.readexactly(protocol.HELLO.size), timeout
+        )
+    except asyncio.TimeoutError:
+        return protocol.LEGACY
+    except asyncio.IncompleteReadError as err:
+        content = err.partial
+    hello = protocol.decode_hello(content)
+    if hello is None:
+        if content:
+            log.warning("Unexpected content from client, using legacy")
+        return protocol.LEGACY
+    version, requested = hello
+    format = protocol.negotiate(requested)
+    writer.write(protocol.encode_hello(format))
+    await writer.drain()
+    log.debug("Client (version %s) using %s framing", version, format)
+    return format
@@ -37,6 +37,8 @@ COMPONENT = "org.freedesktop.IBus.%s" % (NAME,)
 USER_RUN_DIR = os.environ.get('XDG_RUNTIME_DIR', '/run/user/%s' % (os.geteuid()))
 RUN_DIR = os.path.join(USER_RUN_DIR, 'listener')
 DEFAULT_PIPE = os.path.join(RUN_DIR, 'clean-events')
+# Milliseconds between preedit updates (about one per display frame)
+PREEDIT_INTERVAL = 16
 
 
 class ListenerEngine(IBus.Engine):
@@ -94,11 +96,19 @@ class ListenerEngine(IBus.Engine):
         #     interpreter.good_commands,
         # )
         # self.lookup_table.ref_sink()
+        # events arrive from other threads, the lock orders preedit
+        # updates against commits
+        self.preedit_lock = threading.Lock()
         super(ListenerEngine, self).__init__()
         ListenerEngine.INSTANCE = self
 
     processing = None
     no_space = False
+    # text currently shown as preedit
+    preedit = ''
+    # text to show on the next preedit update, None if no update is due
+    pending_preedit = None
+    preedit_timer = None
 
     def do_focus_in(self):
         log.debug("engine received focus")
@@ -127,6 +137,10 @@ class ListenerEngine(IBus.Engine):
     def do_focus_out(self):
         log.debug("the engine lost focus")
         self.wanted = False
+        # the client discards our preedit when it loses focus
+        with self.preedit_lock:
+            self.pending_preedit = None
+            self.preedit = ''
 
     def do_enable(self):
         log.debug("the engine was enabled")
@@ -159,31 +173,78 @@ class ListenerEngine(IBus.Engine):
         GLib.idle_add(self.on_decoding_event, event)
 
     def on_decoding_event(self, event):
-        """We have received an event, update IBus with the details"""
-        if not event.partial:
-            transcript = self.first_transcript(event)
+        """We have received an event, update IBus with the details
+
+        Partials are shown as preedit text, a final replaces the
+        preedit with the committed text.
+        """
+        transcript = self.first_transcript(event)
+        if event.partial:
+            if transcript is not None:
+                self.schedule_preedit(self.format_words(transcript.words)[0])
+            return
+        log.debug('Words: %s', transcript.words if transcript else None)
+        with self.preedit_lock:
+            self.pending_preedit = None
+            if self.preedit:
+                self.preedit = ''
+                self.update_preedit_text(IBus.Text.new_from_string(''), 0, False)
+            if transcript is None:
+                return
             # ick, 'he' is the default in the particular 0.7.3 released language model... meh
-            to_send = []
-            log.debug('Words: %s', transcript.words)
-            for word in transcript.words:
-                if word == '^':
-                    self.no_space = True
-                elif isinstance(word, str):
-                    if not self.no_space:
-                        to_send.append(' ')
-                    to_send.append(word)
-                    self.no_space = False
-                else:
-                    log.info("Should do key-forwarding or the like here: %s", word)
-                    # When we do meta-manipulation we have "tapped a key"
-                    self.no_space = True
             # TODO: if confidence below some threshold, then we want to
             # show options, but that doesn't seem to work at all :(
-            block = ''.join(to_send)
+            block, self.no_space = self.format_words(transcript.words)
             log.debug('> %s', block)
-            self.commit_text(IBus.Text.new_from_string(''.join(block)))
-        else:
-            log.info("Partial")
+            self.commit_text(IBus.Text.new_from_string(block))
+
+    def format_words(self, words):
+        """Join words for display/commit, returns (text, no_space)
+
+        no_space -- whether the text ended with a no-space marker
+        """
+        to_send = []
+        no_space = self.no_space
+        for word in words:
+            if word == '^':
+                no_space = True
+            elif isinstance(word, str):
+                if not no_space:
+                    to_send.append(' ')
+                to_send.append(word)
+                no_space = False
+            else:
+                log.info("Should do key-forwarding or the like here: %s", word)
+                # When we do meta-manipulation we have "tapped a key"
+                no_space = True
+        return ''.join(to_send), no_space
+
+    def schedule_preedit(self, text):
+        """Show text as the preedit on the next (coalesced) update
+
+        Partials can arrive much faster than anyone can read them, so
+        we only update the preedit once per PREEDIT_INTERVAL with the
+        latest text.
+        """
+        with self.preedit_lock:
+            self.pending_preedit = text
+            if self.preedit_timer is None:
+                self.preedit_timer = GLib.timeout_add(
+                    PREEDIT_INTERVAL, self.flush_preedit
+                )
+
+    def flush_preedit(self):
+        """Send the latest pending preedit text (if it changed) to IBus"""
+        with self.preedit_lock:
+            self.preedit_timer = None
+            text, self.pending_preedit = self.pending_preedit, None
+            if text is not None and text != self.preedit:
+                self.preedit = text
+                self.update_preedit_text(
+                    IBus.Text.new_from_string(text), len(text), bool(text)
+                )
+        # one-shot timeout
+        return False
 
     def first_transcript(self, event):
         for transcript in event.transcripts:
@@ -1,8 +1,8 @@
 """Provide for the interpretation of incoming utterances based on user provided rules
 """
 import re, logging, os, json, typing
-from . import defaults, ruleloader, models, eventreceiver
-from .context import Context
+from . import defaults, ruleloader, models, eventreceiver, latency, uinputdriver
+from .context import Context, ContextPool
 import pydantic
 
 log = logging.getLogger(__name__)
@@ -54,6 +54,7 @@ class Interpreter(pydantic.BaseModel):
     current_context: Context = None
     sockname: str = defaults.RAW_EVENTS
     connect_backoff: float = 2.0
+    interpret_partials: bool = True
 
     def __str__(self):
         return '%s(current_context_name=%r)' % (
@@ -61,15 +62,28 @@ class Interpreter(pydantic.BaseModel):
             self.current_context_name,
         )
 
+    @models.justonce_property
+    def preview(self):
+        """Side-effect free stand-in for ourselves used when interpreting partials"""
+        return PreviewInterpreter(interpreter=self)
+
+    @models.justonce_property
+    def context_pool(self):
+        """Pool of loaded contexts we can switch between"""
+        return ContextPool()
+
     def set_context(self, name):
-        """Reload our currently configured context"""
+        """Switch to the named context, re-using it if already loaded"""
         log.info("Switching context to %s", name)
         try:
-            context = self.current_context = Context.by_name(name)
+            context = self.current_context = self.context_pool.get(name)
             self.current_context_name = name
         except Exception as err:
             log.error("Cannot set the dictation context to: %r", name)
             return self.current_context
+        self.context_pool.preload(
+            context.reachable_contexts() + self.stopped_context_names
+        )
         return context
 
     def run(self, result_queue):
@@ -90,7 +104,10 @@ class Interpreter(pydantic.BaseModel):
                 # Note that this is not  necessarily the context above as we can switch
                 #  between context based on the  output of a given command
                 result_queue.put(self.process_event(self.current_context, event))
+                self.preview.reset()
             elif event.partial:
+                if self.interpret_partials:
+                    event = self.preview.process_partial(self.current_context, event)
                 result_queue.put(event)
             else:
                 log.info('BACKEND: %s', " ".join(getattr(event, 'messages', None)))
@@ -106,7 +123,7 @@ class Interpreter(pydantic.BaseModel):
         event = context.apply_rules(event, interpreter=self)
         best_guess = event.best_guess()
         log.info('    ==> %s', event.best_guess().words)
-        return event
+        return latency.stamp(event, 'interpreted')
 
     def temp_context(self, name):
         log.info(
@@ -136,6 +153,12 @@ class Interpreter(pydantic.BaseModel):
         )
         return self.restore_context()
 
+    def stop_typing(self):
+        """Abandon any keystrokes still being typed"""
+        log.info("Stop typing")
+        uinputdriver.cancel_typing()
+        return []
+
     def start_spelling(self):
         """Start the phonetic spelling context"""
         return self.temp_context(defaults.SPELLING_CONTEXT)
@@ -145,6 +168,95 @@ class Interpreter(pydantic.BaseModel):
         return self.restore_context()
 
 
+class PreviewInterpreter(object):
+    """Interprets partial results for display without running commands
+
+    Command rules call back into the interpreter to switch contexts and
+    the like, here those calls do nothing, so the command words are
+    still consumed in the preview but nothing happens until the final
+    result is processed by the real interpreter.
+
+    Successive partials mostly repeat the previous partial with a few
+    words appended or revised at the end, so we cache the interpretation
+    of the prefix up to the last offset no rule can span (see
+    RuleAutomaton.boundaries) and only apply rules to the words after it.
+    As rules rewrite words which later passes match again, the offset is
+    only cached if no rule could span it in any of the passes over the
+    prefix.
+    """
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.reset()
+
+    def reset(self):
+        """Forget the cached prefix (e.g. on a final or context change)"""
+        self.context = None
+        self.prefix = []
+        self.interpreted = []
+
+    def process_partial(self, context, event):
+        """Apply the context's rules to the (best) transcript of a partial event
+
+        Partials only carry a single transcript, so no scoring is done.
+        """
+        if not event.transcripts:
+            return event
+        transcript = event.transcripts[0]
+        words = transcript.words
+        if context is not self.context or words[: len(self.prefix)] != self.prefix:
+            self.reset()
+            self.context = context
+        start = len(self.prefix)
+        interpreted = self.interpreted
+        # the last word is the most likely to be revised by the next partial
+        stable = start
+        for boundary in context.automaton.boundaries(words[start:-1]):
+            stable = start + boundary
+        if stable > start:
+            history = []
+            segment = self.interpret(context, event, words[start:stable], history)
+            if any(context.automaton.open_at_end(scanned) for scanned in history):
+                # a rewritten word could match together with the words after it
+                stable = start
+            else:
+                interpreted = interpreted + segment
+                self.prefix = words[:stable]
+                self.interpreted = interpreted
+        tail = self.interpret(context, event, words[stable:])
+        new_words = models.compress_no_spaces(interpreted + tail)
+        if new_words != words:
+            transcript.words = new_words
+            transcript.text = models.words_to_text(new_words)
+        return event
+
+    def interpret(self, context, event, words, history=None):
+        """Apply rules to words, returning the transformed words"""
+        if not words:
+            return []
+        return models.apply_rules(
+            models.Transcript(words=words),
+            context.automaton,
+            interpreter=self,
+            event=event,
+            context=context,
+            command_only=context.name == defaults.STOPPED_CONTEXT,
+            history=history,
+        )
+
+    def __getattr__(self, name):
+        """Commands (methods) do nothing, state is read from the interpreter"""
+        value = getattr(self.interpreter, name)
+        if callable(value):
+            return ignore_command
+        return value
+
+
+def ignore_command(*args, **named):
+    """Stand-in for interpreter commands while previewing"""
+    return []
+
+
 def main():
     from . import eventreceiver, eventserver
 
@@ -1,6 +1,63 @@
-import pydantic
+import pydantic, logging, os, threading
 from . import models
 
+log = logging.getLogger(__name__)
+
+# (realpath, mtime): [model, reference count]
+_MODELS = {}
+_MODELS_LOCK = threading.Lock()
+
+
+def model_key(path):
+    """Get the registry key for the language model at path"""
+    path = os.path.realpath(path)
+    return (path, os.stat(path).st_mtime_ns)
+
+
+def acquire_model(path, lazy=True):
+    """Get the (shared) language model at path, adding a reference to it
+
+    Every context using the same language model file shares a single
+    loaded model, call release_model when done with it.
+
+    lazy -- memory-map the model and let pages load on demand (only
+            pages actually used become resident) rather than reading
+            the whole model up-front
+    """
+    key = model_key(path)
+    with _MODELS_LOCK:
+        entry = _MODELS.get(key)
+        if entry is None:
+            entry = _MODELS[key] = [_load_model(key[0], lazy), 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def release_model(model):
+    """Drop a reference to model, unloading it once no scorer uses it"""
+    with _MODELS_LOCK:
+        for key, entry in list(_MODELS.items()):
+            if entry[0] is model:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    log.info("Unloading language model %s", key[0])
+                    del _MODELS[key]
+                return
+
+
+def _load_model(path, lazy=True):
+    """Load the KenLM language model at path"""
+    # NOTE: we do *not* import this at the top level of
+    # the module so that the plugin can be loaded without
+    # loading up the dependency
+    import kenlm
+
+    log.info("Loading language model %s (lazy=%s)", path, lazy)
+    config = kenlm.Config()
+    if lazy:
+        config.load_method = kenlm.LoadMethod.LAZY
+    return kenlm.Model(path, config)
+
 
 class KenLMScorer(pydantic.BaseModel):
     """Score based on a KenLM model as in upsteam DeepSpeech"""
@@ -15,21 +72,56 @@ class KenLMScorer(pydantic.BaseModel):
 
     @models.justonce_property
     def scorer(self):
-        """Load our scorer model (a KenLM model by default)"""
-        # NOTE: we do *not* import this at the top level of
-        # the module so that the plugin can be loaded without
-        # loading up the dependency
+        """Get our (shared) scorer model (a KenLM model by default)"""
+        return acquire_model(
+            self.definition.language_model, lazy=self.definition.lazy_load
+        )
+
+    def preload(self):
+        """Load our scorer model before we need it"""
+        return self.scorer
+
+    def close(self):
+        """Release our reference to our (shared) scorer model"""
+        model = self.__dict__.pop('__scorer_value', None)
+        if model is not None:
+            release_model(model)
+
+    def score_texts(self, texts):
+        """Score full-sentence texts, sharing the work for common prefixes
+
+        Equivalent to scorer.score(text) for each text, but n-best
+        transcripts mostly share long word prefixes, so the model state
+        after each prefix is reused rather than rescoring it.
+        """
         import kenlm
 
-        model = kenlm.Model(self.definition.language_model)
-        return model
+        scorer = self.scorer
+        # prefix trie of [state after prefix, score of prefix, children]
+        root = [kenlm.State(), 0.0, {}]
+        scorer.BeginSentenceWrite(root[0])
+        scores = []
+        for text in texts:
+            node = root
+            for word in text.split():
+                child = node[2].get(word)
+                if child is None:
+                    state = kenlm.State()
+                    child = node[2][word] = [
+                        state,
+                        node[1] + scorer.BaseScore(node[0], word, state),
+                        {},
+                    ]
+                node = child
+            scores.append(node[1] + scorer.BaseScore(node[0], '</s>', kenlm.State()))
+        return scores
 
     def score(self, utterance: models.Utterance):
         """Score the utterance"""
-        scorer = self.scorer
-        scores = []
-        for transcript in utterance.transcripts:
-            score = scorer.score(transcript.text)
+        scores = self.score_texts(
+            [transcript.text for transcript in utterance.transcripts]
+        )
+        for transcript, score in zip(utterance.transcripts, scores):
             # log probability mulitplication based on the scorer
             transcript.confidence += score
         return utterance
@@ -0,0 +1,147 @@
+"""Latency tracing for utterances moving through the pipeline
+
+Each stage stamps the utterance's timings with the (time.monotonic)
+time at which the utterance reached it. CLOCK_MONOTONIC is system-wide
+on Linux (including within docker containers), so stamps from the
+daemon and the desktop processes can be compared directly.
+
+    audio -- the latest speech frame (the end of speech for finals)
+             arrived in the daemon
+    vad -- voice activity detection closed the utterance
+    decoded -- the recogniser returned the transcripts
+    queued -- the (first) event server queued the event for its clients,
+              the stamp travels in the event itself so it cannot be taken
+              after the socket write, queued->received includes the time
+              spent waiting in the client's queue
+    received -- the event was decoded by a client
+    interpreted -- the interpreter finished scoring/applying rules
+    committed -- the text was committed to the desktop
+"""
+import time, threading, logging, bisect
+
+log = logging.getLogger(__name__)
+
+STAGES = (
+    'audio',
+    'vad',
+    'decoded',
+    'queued',
+    'received',
+    'interpreted',
+    'committed',
+)
+TOTAL = 'total'
+# Upper bounds (seconds) of the histogram buckets, the last bucket is unbounded
+BUCKETS = (
+    0.001,
+    0.002,
+    0.005,
+    0.01,
+    0.02,
+    0.05,
+    0.1,
+    0.2,
+    0.5,
+    1.0,
+    2.0,
+    5.0,
+)
+
+
+def stamp(record, stage, when=None):
+    """Record that record (Utterance or json-compatible dict) reached stage"""
+    if when is None:
+        when = time.monotonic()
+    if isinstance(record, dict):
+        record.setdefault('timings', {})[stage] = when
+    else:
+        record.timings[stage] = when
+    return record
+
+
+def stage_latencies(timings):
+    """Convert a timings dict to [(stage, seconds since previous stage)]
+
+    The final entry is the TOTAL from the first to the last stage reached.
+    """
+    reached = [(stage, timings[stage]) for stage in STAGES if stage in timings]
+    result = [
+        (stage, when - previous)
+        for (_, previous), (stage, when) in zip(reached, reached[1:])
+    ]
+    if result:
+        result.append((TOTAL, reached[-1][1] - reached[0][1]))
+    return result
+
+
+def format_latencies(latencies):
+    """Format stage_latencies for logging"""
+    return ', '.join('%s %0.0fms' % (stage, delay * 1000) for stage, delay in latencies)
+
+
+class LatencyHistogram(object):
+    """Fixed-bucket histogram of latencies (in seconds)"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction):
+        """Estimate the given percentile as the upper bound of its bucket"""
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def stats(self):
+        """Summarise as a dict of floats (for logging/DBus)"""
+        return {
+            'count': float(self.count),
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+
+class LatencyTracker(object):
+    """Per-stage latency histograms for the utterances seen by a process"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def record(self, event):
+        """Add the latencies of a (completed) event, returns stage_latencies"""
+        latencies = stage_latencies(event.timings)
+        with self.lock:
+            for stage, delay in latencies:
+                histogram = self.histograms.get(stage)
+                if histogram is None:
+                    histogram = self.histograms[stage] = LatencyHistogram()
+                histogram.add(delay)
+        if latencies:
+            log.info('Latency: %s', format_latencies(latencies))
+        return latencies
+
+    def stats(self):
+        """Give the summary stats for each stage seen so far"""
+        with self.lock:
+            return dict(
+                (stage, histogram.stats())
+                for stage, histogram in self.histograms.items()
+            )
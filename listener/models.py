@@ -2,6 +2,7 @@
 import pydantic, os, logging, json
 from typing import List, Optional, Callable, Dict, Union
 from . import defaults
+from .automaton import RuleAutomaton
 
 log = logging.getLogger(__name__)
 
@@ -146,6 +147,8 @@ class Utterance(pydantic.BaseModel):
     final: bool = True
     transcripts: List[Transcript] = []
     messages: Optional[List[str]] = []
+    stream_id: Optional[str] = None  # audio source in multi-stream daemons
+    timings: Dict[str, float] = {}  # monotonic time of each stage, see latency
 
     def sort(self):
         """Apply sorting to our transcripts
@@ -209,6 +212,8 @@ class ScorerDefinition(pydantic.BaseModel):
     name: str = 'default'
     language_model: Optional[str] = defaults.CACHED_SCORER_FILE
     command_bias: Optional[float] = 1.0
+    # memory-map the language model rather than reading it into memory
+    lazy_load: bool = True
 
     @classmethod
     def by_name(cls, name):
@@ -309,6 +314,15 @@ class ContextDefinition(pydantic.BaseModel):
             rules='spelling',
         )
         spelling.save()
+        typing = ContextDefinition(
+            name=defaults.TYPING_CONTEXT,
+            scorers=[
+                ScorerDefinition.by_name('default'),
+                ScorerDefinition(name='commands', type='commands',),
+            ],
+            rules='typing',
+        )
+        typing.save()
 
     @classmethod
     def directory(cls, name):
@@ -426,81 +440,42 @@ class RuleMatch(pydantic.BaseModel):
 SPECIAL_KEYS = (defaults.WORD_MARKER, defaults.PHRASE_MARKER, None)
 
 
-def iter_matches(words, rules):
-    """Generate all rule-matchings for the given words across all rules"""
-    for start in range(len(words)):
-        branch = rules
-        var_phrase = None
-        var_words = []
-        i = 0
-        for i, word in enumerate(words[start:]):
-            if word in branch:
-                branch = branch[word]
-            elif branch is not rules and defaults.WORD_MARKER in branch:
-                branch = branch[defaults.WORD_MARKER]
-                var_words.append(word)
-            elif branch is not rules and defaults.PHRASE_MARKER in branch:
-                branch = branch[defaults.PHRASE_MARKER]
-                # IFF rules match the phrase, process the phrase
-                var_phrase = words[i:]
-                break
-            else:
-                # we don't match any further rules, do we
-                # have a current match?
-                i -= 1
-                break
-        if None in branch:
-            rule = branch[None]
-            return RuleMatch(
-                rule=rule,
-                words=words[:],
-                start_index=start,
-                stop_index=start + i + 1,
-                var_words=var_words,
-                var_phrase=var_phrase,
-            )
+def compile_rules(rules):
+    """Compile a rule trie into a RuleAutomaton (if it is not one already)"""
+    if isinstance(rules, RuleAutomaton):
+        return rules
+    return RuleAutomaton(rules)
+
+
+def iter_matches(words, rules, start=0, stop=None):
+    """Generate the longest rule-matching at each start across all rules
+
+    rules -- RuleAutomaton, or a rule trie which will be compiled
+             (on every call, so compile once when matching repeatedly)
+    """
+    for start, stop, rule, var_words, var_phrase in compile_rules(rules).matches(
+        words, start, stop
+    ):
+        yield RuleMatch(
+            rule=rule,
+            words=words[start:stop],
+            start_index=start,
+            stop_index=stop,
+            var_words=var_words,
+            var_phrase=var_phrase,
+        )
 
 
 def match_rules(words, rules, seen=None, start=0):
-    """Find rules which match in the rules"""
+    """Find the first rule which matches in words at or after start"""
     seen = seen or set()
-
-    for start in range(start, len(words)):
-        branch = rules
-        var_phrase = None
-        var_words = []
-        i = 0
-        for i, word in enumerate(words[start:]):
-            if word in branch:
-                branch = branch[word]
-            elif branch is not rules and defaults.WORD_MARKER in branch:
-                branch = branch[defaults.WORD_MARKER]
-                var_words.append(word)
-            elif branch is not rules and defaults.PHRASE_MARKER in branch:
-                branch = branch[defaults.PHRASE_MARKER]
-                var_phrase = words[i:]
-                # we are pointing at the first word, advance to the last word in phrase...
-                i += len(var_phrase) - 1
-                break
-            else:
-                # we don't match any further rules, do we
-                # have a current match?
-                i -= 1
-                break
-        if None in branch:  # a rule stops at this point
-            rule = branch[None]
-            if (i, rule) in seen:
-                log.info("Already ran rule %s at %s", rule, i)
-                continue
-            seen.add((i, rule))
-            return RuleMatch(
-                rule=rule,
-                words=words[start : start + i + 1],
-                start_index=start,
-                stop_index=start + i + 1,
-                var_words=var_words,
-                var_phrase=var_phrase,
-            )
+    for match in iter_matches(words, rules, start):
+        key = (match.stop_index - match.start_index - 1, match.rule)
+        if key in seen:
+            log.info("Already ran rule %s at %s", match.rule, key[0])
+            continue
+        seen.add(key)
+        return match
 
 
 def compress_no_spaces(working):
@@ -519,6 +494,31 @@ def compress_no_spaces(working):
     return result
 
 
+def compress_span(working, start, stop):
+    """Compress out repeated no space markers in working[start:stop] in place
+
+    returns the number of markers removed
+    """
+    removed = 0
+    for index in range(min(stop, len(working)) - 1, max(start, 1) - 1, -1):
+        if working[index] == '^' and working[index - 1] == '^':
+            del working[index]
+            removed += 1
+    return removed
+
+
+def merge_spans(spans):
+    """Merge overlapping/adjacent (start, stop) spans (sorted by start)"""
+    merged = []
+    for start, stop in spans:
+        if merged and start <= merged[-1][1]:
+            if stop > merged[-1][1]:
+                merged[-1] = (merged[-1][0], stop)
+        else:
+            merged.append((start, stop))
+    return merged
+
+
 def apply_rules(
     transcript,
     rules,
@@ -528,54 +528,64 @@ def apply_rules(
     event=None,
     interpreter=None,
     command_only=False,
+    history=None,
 ):
-    """Iteratively apply rules from rule-set until nothing changes"""
-    match_set = set()
-    working = transcript.words[:]
-    # log.info("Working: %s", working)
+    """Iteratively apply rules from rule-set until nothing changes
+
+    Each pass only rescans the start offsets from which a match could
+    overlap words changed by the previous pass, so words untouched by
+    rules are only scanned once.
+
+    history -- if a list, a copy of the words scanned by each pass (and
+               of the final result) is appended to it
+    """
+    rules = compile_rules(rules)
+    # a match starting this far before a change could include it
+    lead = max(rules.max_depth, 1)
+    working = compress_no_spaces(transcript.words)
+    windows = [(0, len(working))]
     for iteration in range(20):
-        # log.info("Iteration: %s", iteration)
+        if history is not None:
+            history.append(working[:])
         matches = 0
-        starting = working[:]
-        match = match_rules(working, rules, match_set)
-        while match and match.stop_index <= len(working):
-            matches += 1
-            match.transcript = transcript
-            match.context = context
-            match.commit = commit
-            transcript.rule_matches = transcript.rule_matches + [match]
-
-            # log.info("Match: %s", match.words)
-
-            transcript.confidence += match_bias
-            rest = working[match.stop_index :]
-            # log.info("Remaining: %s", rest)
-            try:
-                transformed = match.rule(match, interpreter=interpreter, event=event)
-                # log.info(
-                #     "Transform %s => %s with %s",
-                #     working[match.start_index : match.stop_index],
-                #     transformed,
-                #     match.rule,
-                # )
-                working[match.start_index : match.stop_index] = transformed
-            except StopIteration as err:
-                # Immediate return...
-                # log.info("Command: %s", working[match.start_index : match.stop_index])
-                del working[match.start_index : match.stop_index]
-
-            if rest:
-                match = match_rules(
-                    working, rules, match_set, start=len(working) - len(rest),
-                )
-            else:
-                # log.info('Reached end')
-                match = None
-                break
+        # windows to rescan on the next pass, around words changed on this one
+        changed = []
+        shift = 0
+        position = 0
+        for start, stop in windows:
+            start, stop = max(start + shift, position), stop + shift
+            while start < stop:
+                match = next(iter_matches(working, rules, start, stop), None)
+                if match is None:
+                    break
+                matches += 1
+                match.transcript = transcript
+                match.context = context
+                match.commit = commit
+                transcript.rule_matches.append(match)
+                transcript.confidence += match_bias
+                try:
+                    transformed = match.rule(match, interpreter=interpreter, event=event)
+                except StopIteration as err:
+                    # Immediate return...
+                    transformed = []
+                first, last = match.start_index, match.stop_index
+                before = working[max(first - 1, 0) : last + 2]
+                working[first:last] = transformed
+                last = first + len(transformed)
+                last -= compress_span(working, first, last + 1)
+                delta = last - match.stop_index
+                if working[max(first - 1, 0) : match.stop_index + 2 + delta] != before:
+                    changed.append((max(first - lead, 0), last + 1))
+                shift += delta
+                stop += delta
+                start = position = last
         transcript.confidence += match_bias * matches
-        working = compress_no_spaces(working)
-        if working == starting:
+        windows = merge_spans(changed)
+        if not windows:
             break
+    if history is not None:
+        history.append(working[:])
     return working
 
 
@@ -0,0 +1,201 @@
+"""Framing for the event sockets
+
+The original (legacy) protocol sends NUL-terminated json messages.
+Clients can instead negotiate a length-prefixed framing by sending
+a HELLO as soon as they connect:
+
+    HELLO: MAGIC (4 bytes), version (uint8), body format (uint8)
+
+The server replies with a HELLO giving the version and the format it
+will actually use (json if the requested format is not available on
+the server), after which each event is sent as a FRAME:
+
+    FRAME: body format (uint8), body length (uint32, network order), body
+
+Servers which do not receive a HELLO shortly after a client connects
+fall back to the legacy protocol, and clients which receive something
+other than a HELLO from the server do the same, so either end can be
+upgraded first.
+"""
+import struct, json, logging
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'LSNR'
+VERSION = 1
+
+LEGACY = 'legacy'
+JSON = 'json'
+MSGPACK = 'msgpack'
+# Wire codes for the (framed) body formats
+FORMATS = {
+    JSON: 1,
+    MSGPACK: 2,
+}
+FORMAT_NAMES = dict((code, name) for name, code in FORMATS.items())
+
+HELLO = struct.Struct('!4sBB')
+HEADER = struct.Struct('!BI')
+TERMINATOR = b'\000'
+
+
+def available_formats():
+    """Give the framed body formats supported in this process"""
+    if msgpack is not None:
+        return [MSGPACK, JSON]
+    return [JSON]
+
+
+def preferred_format():
+    """Give the best framed body format supported in this process"""
+    return available_formats()[0]
+
+
+def negotiate(requested):
+    """Choose the body format to use for a client which requested requested"""
+    if requested in available_formats():
+        return requested
+    return JSON
+
+
+def encode_hello(format=JSON):
+    """Encode a HELLO requesting/confirming format"""
+    return HELLO.pack(MAGIC, VERSION, FORMATS[format])
+
+
+def decode_hello(content):
+    """Decode a HELLO, returning (version, format), or None if it is not a HELLO"""
+    if len(content) < HELLO.size:
+        return None
+    magic, version, code = HELLO.unpack_from(content)
+    if magic != MAGIC:
+        return None
+    return version, FORMAT_NAMES.get(code, JSON)
+
+
+def encode_header(format, length):
+    """Encode the header for a body of length bytes"""
+    return HEADER.pack(FORMATS[format], length)
+
+
+def dumps(struct, format=JSON):
+    """Encode a json-compatible struct as a body in the given format"""
+    if format == MSGPACK:
+        return msgpack.packb(struct, use_bin_type=True)
+    return json.dumps(struct, separators=(',', ':')).encode('utf-8')
+
+
+def loads(body, format=JSON):
+    """Decode a body (any bytes-like object, e.g. a memoryview) in the given format"""
+    if format == MSGPACK:
+        return msgpack.unpackb(body, raw=False)
+    # json.loads rejects memoryviews, decoding to str is needed anyway
+    return json.loads(str(body, 'utf-8'))
+
+
+class FrameReader(object):
+    """Incremental reader for messages arriving on an event socket
+
+    Content is read with recv_into into a single (growable) buffer, and
+    complete messages are decoded from memoryviews of that buffer, so
+    message bodies are never copied out of it and large messages arriving
+    in many small reads do not cause repeated concatenation/rescanning.
+
+    format -- framed body format we requested, or LEGACY for the
+              NUL-terminated json protocol, once the server has replied
+              this is updated to the format actually in use
+    """
+
+    def __init__(self, format=JSON, size=65536):
+        self.format = format
+        self.negotiating = format != LEGACY
+        self.buffer = bytearray(size)
+        self.start = self.end = 0
+        self.scanned = 0
+
+    def free_space(self):
+        """Give a writable memoryview of the buffer after the content read so far
+
+        Read into the view (e.g. with recv_into or loop.sock_recv_into),
+        release it, then call wrote() with the number of bytes read.
+        """
+        if self.start == self.end:
+            self.start = self.end = self.scanned = 0
+        elif self.end == len(self.buffer):
+            self.make_room()
+        return memoryview(self.buffer)[self.end :]
+
+    def wrote(self, count):
+        """Record that count bytes were read into the free_space() view"""
+        self.end += count
+
+    def recv_from(self, sock):
+        """Read available content from sock, returns number of bytes read"""
+        with self.free_space() as view:
+            count = sock.recv_into(view)
+        self.wrote(count)
+        return count
+
+    def make_room(self, needed=1):
+        """Compact (or grow) the buffer to make room for more content"""
+        pending = self.end - self.start
+        if self.start:
+            self.buffer[:pending] = self.buffer[self.start : self.end]
+            self.scanned -= self.start
+            self.start, self.end = 0, pending
+        size = len(self.buffer)
+        while pending * 2 > size or size - pending < needed:
+            size *= 2
+        if size > len(self.buffer):
+            self.buffer.extend(bytes(size - len(self.buffer)))
+
+    def __iter__(self):
+        """Decode and yield all of the complete messages read so far"""
+        if self.negotiating:
+            if self.end - self.start < HELLO.size:
+                return
+            self.negotiating = False
+            hello = decode_hello(self.buffer[self.start : self.start + HELLO.size])
+            if hello is None:
+                log.info("Server did not negotiate framing, using legacy protocol")
+                self.format = LEGACY
+            else:
+                _, self.format = hello
+                self.start += HELLO.size
+                log.debug("Negotiated %s framing", self.format)
+        if self.format == LEGACY:
+            messages = self.iter_terminated()
+        else:
+            messages = self.iter_framed()
+        for format, start, stop in messages:
+            # release the view before yielding, the buffer can only be
+            # resized (make_room) while no views of it exist
+            with memoryview(self.buffer)[start:stop] as body:
+                decoded = loads(body, format)
+            yield decoded
+
+    def iter_terminated(self):
+        """Yield (format, start, stop) for each complete NUL-terminated message"""
+        while True:
+            stop = self.buffer.find(TERMINATOR, max(self.start, self.scanned), self.end)
+            if stop == -1:
+                self.scanned = self.end
+                return
+            start, self.start = self.start, stop + 1
+            self.scanned = self.start
+            yield JSON, start, stop
+
+    def iter_framed(self):
+        """Yield (format, start, stop) of the body of each complete frame"""
+        while self.end - self.start >= HEADER.size:
+            code, length = HEADER.unpack_from(self.buffer, self.start)
+            stop = self.start + HEADER.size + length
+            if stop > self.end:
+                return
+            start, self.start = self.start + HEADER.size, stop
+            yield FORMAT_NAMES.get(code, JSON), start, stop
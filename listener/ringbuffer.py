@@ -6,57 +6,151 @@ from . import defaults
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 
+# Policies for a current record (utterance) that would outgrow the buffer
+OVERFLOW_SPLIT = 'split'  # end the record, the caller starts a new one
+OVERFLOW_DROP = 'drop-oldest'  # keep the record, forget its oldest samples
+OVERFLOW_POLICIES = (OVERFLOW_SPLIT, OVERFLOW_DROP)
+
+
 class RingBuffer(object):
-    """Crude numpy-backed ringbuffer"""
+    """Crude numpy-backed ringbuffer
+
+    overflow -- policy to apply when the current record (from start
+                to write_head) would be overwritten by incoming data,
+                see OVERFLOW_POLICIES
 
-    def __init__(self, duration=30, rate=defaults.SAMPLE_RATE):
+    overruns -- count of reads which hit the overflow policy
+    underruns -- count of reads where the source could not fill the block
+    overflowed -- set when the split policy ended the current record,
+                  the consumer is responsible for clearing it
+    """
+
+    def __init__(self, duration=30, rate=defaults.SAMPLE_RATE, overflow=OVERFLOW_SPLIT):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                'Unknown overflow policy %r, expected one of %s'
+                % (overflow, OVERFLOW_POLICIES)
+            )
         self.duration = duration
         self.rate = rate
         self.size = duration * rate
         self.buffer = np.zeros((self.size,), dtype=np.int16)
         self.write_head = 0
         self.start = 0
+        self.overflow = overflow
+        self.overflowed = False
+        self.overruns = 0
+        self.underruns = 0
 
     def read_in(self, file_handle, blocksize=1024):
-        """Read in content from the buffer"""
-        target = self.buffer[self.write_head : self.write_head + blocksize]
-        if hasattr(file_handle, 'readinto'):
-            # On the blocking fifo this consistently reads
-            # the whole blocksize chunk of data...
-            written = file_handle.readinto(target)
-            if written != blocksize * 2:
-                log.debug(
-                    "Didn't read the whole buffer (likely disconnect): %s/%s",
-                    written,
-                    blocksize // 2,
-                )
-                target = target[: (written // 2)]
-        else:
-            # This is junk, unix and localhost buffering in ffmpeg
-            # means we take 6+ reads to get a buffer and we wind up
-            # losing a *lot* of audio due to delays
-            tview = target.view(np.uint8)
-            written = 0
-            reads = 0
-            while written < blocksize:
-                written += file_handle.recv_into(tview[written:], blocksize - written)
-                reads += 1
-            if reads > 1:
-                log.debug("Took %s reads to get %s bytes", reads, written)
-        self.write_head = (self.write_head + written) % self.size
-        return target
-
-    def itercurrent(self):
+        """Read up to blocksize samples from file_handle into the buffer
+
+        The read is split into two segments where it crosses the end of
+        the buffer, so it only comes back short when the source does
+        (which normally means the source disconnected).
+
+        returns the number of samples read
+        """
+        self.check_overrun(blocksize)
+        read = 0
+        while read < blocksize:
+            count = min(blocksize - read, self.size - self.write_head)
+            target = self.buffer[self.write_head : self.write_head + count]
+            written = self.read_segment(file_handle, target)
+            self.write_head = (self.write_head + written) % self.size
+            read += written
+            if written < count:
+                break
+        if read < blocksize:
+            self.underruns += 1
+            log.debug(
+                "Didn't read the whole buffer (likely disconnect): %s/%s",
+                read,
+                blocksize,
+            )
+        return read
+
+    def read_segment(self, file_handle, target):
+        """Fill target from file_handle, returning the number of samples read
+
+        On the blocking fifo readinto consistently reads the whole segment,
+        but unix and localhost buffering in ffmpeg means sockets can take
+        6+ reads to fill it, so we keep reading until the source is empty.
+        A trailing partial sample (only possible on disconnect) is discarded.
+        """
+        view = target.view(np.uint8)
+        reader = getattr(file_handle, 'readinto', None) or file_handle.recv_into
+        written = reads = 0
+        while written < len(view):
+            update = reader(view[written:])
+            if not update:
+                break
+            written += update
+            reads += 1
+        if reads > 1:
+            log.debug("Took %s reads to get %s bytes", reads, written)
+        return written // 2
+
+    def check_overrun(self, incoming):
+        """Apply our overflow policy if incoming would overwrite the current record"""
+        excess = len(self) + incoming - (self.size - 1)
+        if excess > 0:
+            self.overruns += 1
+            if self.overflow == OVERFLOW_SPLIT:
+                log.info("Record is longer than %ss, splitting", self.duration)
+                self.start = self.write_head
+                self.overflowed = True
+            else:
+                log.info("Record is longer than %ss, dropping oldest", self.duration)
+                self.start = self.wrap(self.start + excess)
+
+    def wrap(self, offset):
+        """Normalise an absolute sample offset into the buffer"""
+        return offset % self.size
+
+    def distance(self, start, stop):
+        """Number of samples from start to stop, allowing for wrap-around"""
+        return (stop - start) % self.size
+
+    def iterframes(self, start, stop, frame_size):
+        """Iterate over frame_size views of the samples from start to stop
+
+        start, stop -- offsets into the buffer, stop may be "before" start
+                       in which case the iteration wraps around the end
+        frame_size -- number of samples in each frame
+
+        Frames are views into the buffer (no copying), so they are only
+        valid until the ring wraps around and overwrites them. A frame
+        that would straddle the end of the buffer (only possible if reads
+        are not frame-aligned) is assembled into a scratch copy. A trailing
+        partial frame is not produced.
+        """
+        offset = self.wrap(start)
+        for _ in range(self.distance(start, stop) // frame_size):
+            end = offset + frame_size
+            if end <= self.size:
+                yield self.buffer[offset:end]
+            else:
+                end -= self.size
+                yield np.concatenate((self.buffer[offset:], self.buffer[:end]))
+            offset = end % self.size
+
+    def itercurrent(self, stop=None):
         """Iterate over all samples in the current record
         
         After we truncate from the beginning we have to
         reset the stream with the content written already
+
+        stop -- if specified, offset at which to stop rather
+                than the write_head (i.e. the content that
+                has been consumed so far)
         """
-        if self.write_head < self.start:
+        stop = self.write_head if stop is None else stop
+        if stop < self.start:
             yield self.buffer[self.start :]
-            yield self.buffer[: self.write_head]
+            yield self.buffer[:stop]
         else:
-            yield self.buffer[self.start : self.write_head]
+            yield self.buffer[self.start : stop]
 
     def __len__(self):
         """Calculate how much data is between end-of-last-read and current-write-head"""
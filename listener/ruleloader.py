@@ -1,5 +1,5 @@
 """Load rules from rule-sets on disk"""
-import logging, os, ast, re
+import logging, os, ast, re, hashlib, pickle, tempfile
 from .ruleregistry import rule_by_name
 from .errors import MissingRules
 from . import defaults
@@ -20,6 +20,12 @@ log = logging.getLogger(__name__)
 
 BOOST_MATCH = re.compile(r'[+-]\d+$')
 
+RULE_CACHE = os.path.join(defaults.CACHE_DIR, 'rules')
+# Increment when the format of the cached rule records changes
+RULE_CACHE_VERSION = 1
+# In-process cache of rule-set name: cache entry
+_PARSED = {}
+
 
 def wanted_args(target, args, kwargs):
     # Only pass optional arguments that are required...
@@ -49,10 +55,8 @@ def bad_text_types(text):
                 return 2
 
 
-def text_entry_rule(match, target):
-    """Create a rule from the text-entry mini-language"""
-    no_space_before = target.startswith('^')
-    no_space_after = target.endswith('^')
+def parse_text(match, target):
+    """Parse the python-literal text of a text-entry target"""
     text = ast.literal_eval(target.strip('^'))
     if bad_text_types(text):
         raise TypeError(
@@ -60,6 +64,20 @@ def text_entry_rule(match, target):
             text,
             "Expect python-literal syntax for unicode, bytes, list-of-unicode or tuple of unicode",
         )
+    if isinstance(text, tuple):
+        text = list(text)
+    return text
+
+
+def text_entry_rule(match, target, text=None):
+    """Create a rule from the text-entry mini-language
+
+    text -- the already-parsed (see parse_text) text of the target
+    """
+    no_space_before = target.startswith('^')
+    no_space_after = target.endswith('^')
+    if text is None:
+        text = parse_text(match, target)
 
     def apply_rule(match, **kwargs):
         """Given a match on the rule, produce modified result"""
@@ -77,7 +95,7 @@ def text_entry_rule(match, target):
             result.append('^')
         return result
 
-    return Rule(
+    return Rule.construct(
         match=match,
         text=text,
         target=target,
@@ -124,7 +142,7 @@ def transform_rule(match, target):
 
         return result
 
-    return Rule(
+    return Rule.construct(
         match=match,
         target=target,
         no_space_after=no_space_after,
@@ -166,7 +184,17 @@ def format_rules(rules):
         yield '%s => %s' % (' '.join(match), target)
 
 
-def iter_rules(name, includes=True):
+def read_ruleset(filename):
+    """Read the content of a rules file"""
+    with open(filename, encoding='utf-8') as handle:
+        return handle.read()
+
+
+def content_hash(content):
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def iter_rules(name, includes=True, files=None):
     """Given rule-file name, iteratively produce all rules
     
     include -- if True, then produce rules from all included
@@ -191,17 +219,31 @@ def iter_rules(name, includes=True):
 
     +int adds the words in the rule to the "boost" set (hotwords) so that 
     their presence will tend to favour processing of the given rule.
+
+    files -- if provided, (name, filename, mtime, size, sha1) is appended
+             for each file read, for validating cached results
     """
     filename = named_ruleset_file(name)
     if filename:
-        command_set = open(filename, encoding='utf-8').read()
+        stat = os.stat(filename)
+        command_set = read_ruleset(filename)
+        if files is not None:
+            files.append(
+                [
+                    name,
+                    filename,
+                    stat.st_mtime_ns,
+                    stat.st_size,
+                    content_hash(command_set),
+                ]
+            )
         for i, line in enumerate(command_set.splitlines()):
             line = line.strip()
             if line.startswith('#include '):
                 if includes:
                     try:
                         for pattern, target, sub_name in iter_rules(
-                            line[9:].strip().strip("'\"")
+                            line[9:].strip().strip("'\""), files=files,
                         ):
                             yield pattern, target, sub_name
                     except MissingRules as err:
@@ -222,24 +264,137 @@ def iter_rules(name, includes=True):
             yield pattern, target, name
 
 
+def rule_records(name):
+    """Parse the named rule-set (with includes) into cacheable records
+
+    returns (files, records) where files are as for iter_rules and
+    records are (pattern, target, source, boost, text) with text None
+    for transformation rules
+    """
+    files = []
+    records = []
+    for pattern, target, source in iter_rules(name, includes=True, files=files):
+        target, boost = split_boost(target)
+        if target.strip('^').endswith('()'):
+            records.append((pattern, target[:-2], source, float(boost), None))
+        else:
+            text = parse_text(pattern, target)
+            records.append((pattern, target, source, float(boost), text))
+    return files, records
+
+
+def files_current(files):
+    """Check whether the files read for a rule-set are unchanged
+
+    Files whose mtime/size have changed are hashed, and if their content
+    is unchanged their entry is updated.
+
+    returns (current, updated)
+    """
+    updated = False
+    for record in files:
+        name, filename, mtime, size, digest = record
+        try:
+            if named_ruleset_file(name) != filename:
+                return False, updated
+            stat = os.stat(filename)
+            if (stat.st_mtime_ns, stat.st_size) != (mtime, size):
+                if content_hash(read_ruleset(filename)) != digest:
+                    return False, updated
+                record[2:4] = stat.st_mtime_ns, stat.st_size
+                updated = True
+        except (OSError, MissingRules):
+            return False, updated
+    return True, updated
+
+
+def rule_cache_file(name):
+    """Calculate the rule cache filename for the given rule-set name"""
+    safe = re.sub(r'[^\w.-]', '_', name)
+    key = hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(RULE_CACHE, '%s-%s.pickle' % (safe, key))
+
+
+def read_rule_cache(name):
+    """Read the on-disk cache entry for name (or None)"""
+    try:
+        with open(rule_cache_file(name), 'rb') as handle:
+            entry = pickle.load(handle)
+    except FileNotFoundError:
+        return None
+    except Exception as err:
+        log.warning("Unable to read rule cache for %s: %s", name, err)
+        return None
+    if not isinstance(entry, dict) or entry.get('version') != RULE_CACHE_VERSION:
+        return None
+    return entry
+
+
+def write_rule_cache(name, entry):
+    """Write the on-disk cache entry for name (failures are only logged)"""
+    filename = rule_cache_file(name)
+    stored = dict((key, entry[key]) for key in ('version', 'files', 'records'))
+    try:
+        os.makedirs(RULE_CACHE, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=RULE_CACHE, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as output:
+            pickle.dump(stored, output, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, filename)
+    except Exception as err:
+        log.warning("Unable to write rule cache for %s: %s", name, err)
+
+
+def build_rules(records):
+    """Create the Rules for parsed rule records"""
+    result = []
+    for pattern, target, source, boost, text in records:
+        if text is None:
+            rule = transform_rule(pattern[:], target)
+        else:
+            rule = text_entry_rule(pattern[:], target, text)
+        rule.source = source
+        rule.boost = boost
+        result.append(rule)
+        log.debug("Rule from %s: %s", source, rule)
+    return result
+
+
+def cached_rules(name):
+    """Get the Rules for the named rule-set, parsing only if its files changed"""
+    entry = _PARSED.get(name) or read_rule_cache(name)
+    if entry is not None:
+        current, updated = files_current(entry['files'])
+        if not current:
+            entry = None
+        elif updated:
+            write_rule_cache(name, entry)
+    if entry is None:
+        log.info("Parsing rule-set %s", name)
+        files, records = rule_records(name)
+        entry = {
+            'version': RULE_CACHE_VERSION,
+            'files': files,
+            'records': records,
+        }
+        write_rule_cache(name, entry)
+    if 'rules' not in entry:
+        entry['rules'] = build_rules(entry['records'])
+    _PARSED[name] = entry
+    return entry['rules']
+
+
 def load_rules(name, rules=None, includes=True):
-    """load a set of commands from a named rule-set"""
-    base_name = name
+    """load a set of commands from a named rule-set
+
+    The parsed rule-set is cached both in-process and in RULE_CACHE,
+    so rules are only re-parsed when one of their files changes.
+    """
     rules = rules or {}
     rule_order = []
-    for pattern, target, name in iter_rules(name, includes=True):
-        target, boost = split_boost(target)
+    for rule in cached_rules(name):
         branch = rules
-        for word in pattern:
+        for word in rule.match:
             branch = branch.setdefault(word, {})
-
-        if target.strip('^').endswith('()'):
-            rule = transform_rule(pattern, target[:-2])
-        else:
-            rule = text_entry_rule(pattern, target)
         branch[None] = rule
-        rule.source = name
-        rule.boost = boost
         rule_order.append(rule)
-        log.debug("Rule from %s: %s", base_name, rule)
     return rules, rule_order
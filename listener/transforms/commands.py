@@ -34,6 +34,13 @@ def restore_context(words, interpreter):
     raise StopIteration('Reached a command operation')
 
 
+@named_rule
+def stop_typing(words, interpreter):
+    """Abandon any keystrokes still being typed"""
+    interpreter.stop_typing()
+    raise StopIteration('Reached a command operation')
+
+
 @named_rule
 def start_spelling(words, interpreter):
     """Switch to the spelling context in the interpreter"""
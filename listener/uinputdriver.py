@@ -1,6 +1,7 @@
 """Drive input through extremely low-level Linux Input"""
-import os, logging, fcntl, time, json, sys
+import os, logging, fcntl, time, json, sys, re, queue, threading
 import ctypes
+from concurrent.futures import Future
 import contextlib
 
 try:
@@ -19,9 +20,26 @@ UI_DEV_CREATE = 0x5501
 UI_DEV_DESTROY = 0x5502
 UI_SET_EVBIT = 0x40045564
 UI_SET_KEYBIT = 0x40045565
+_IOC_READ = 2
+SYSNAME_SIZE = 64
+# UI_GET_SYSNAME(len), i.e. _IOC(_IOC_READ, 'U', 44, len)
+UI_GET_SYSNAME = (_IOC_READ << 30) | (SYSNAME_SIZE << 16) | (ord('U') << 8) | 44
+SYSFS_INPUT = '/sys/devices/virtual/input'
+DEV_INPUT = '/dev/input'
+# Seconds to wait for a newly created device to show up
+READY_TIMEOUT = 1.0
+READY_POLL = 0.002
+# Seconds to sleep when the kernel cannot tell us the device name
+READY_FALLBACK = 0.05
 EV_SYN = 0x00
 EV_KEY = 0x1
 SYN_REPORT = 0
+# Seconds to wait for a <PAUSE> in an input string
+PAUSE_DURATION = 0.1
+# Escaped < and >, <named+keys> and single characters in an input string
+INPUT_TOKENS = re.compile(r'<<>|<>>|<[^>]*>|.', re.S)
+# Characters which get a slot in the dense translation table
+TABLE_SIZE = 128
 
 
 class input_id(ctypes.Structure):
@@ -61,6 +79,83 @@ class uinput_user_dev(ctypes.Structure):
     ]
 
 
+EVENT_SIZE = ctypes.sizeof(input_event)
+
+
+def compile_strokes(strokes, sync_group=1, events=None):
+    """Compile strokes into a single array of input events
+
+    strokes -- as produced by UInput.parse_input_string, each stroke is a
+               list of key codes which are pressed in order and released
+               in reverse order, an empty stroke is a pause
+    sync_group -- number of strokes sent between SYN_REPORT events, 1
+                  (a report per stroke) is the most compatible, larger
+                  groups mean fewer events for long strings
+    events -- input_event array to re-use, a larger one is allocated
+              only if strokes do not fit, only the used slots are written
+
+    returns (events, batches) where batches is a list of (start, stop)
+    indices into events, each batch is written at once and we pause
+    between batches
+    """
+    keys = sum(len(stroke) for stroke in strokes)
+    needed = keys * 2 + len(strokes)
+    if events is None or len(events) < needed:
+        size = max(needed, len(events) * 2 if events is not None else 0)
+        events = (input_event * size)()
+    batches = []
+    index = start = pending = 0
+    for stroke in strokes:
+        if not stroke:
+            if pending:
+                _set_event(events[index], EV_SYN, SYN_REPORT, 0)
+                index += 1
+                pending = 0
+            batches.append((start, index))
+            start = index
+            continue
+        for code in stroke:
+            _set_event(events[index], EV_KEY, code, 1)
+            index += 1
+        for code in reversed(stroke):
+            _set_event(events[index], EV_KEY, code, 0)
+            index += 1
+        pending += 1
+        if pending >= sync_group:
+            _set_event(events[index], EV_SYN, SYN_REPORT, 0)
+            index += 1
+            pending = 0
+    if pending:
+        _set_event(events[index], EV_SYN, SYN_REPORT, 0)
+        index += 1
+    batches.append((start, index))
+    return events, batches
+
+
+def _set_event(event, type, code, value):
+    # re-used slots still hold the previous string's values
+    event.type = type
+    event.code = code
+    event.value = value
+
+
+def find_event_node(sysname, sysfs=SYSFS_INPUT, devices=DEV_INPUT):
+    """Find the /dev/input/event* node for the input device sysname
+
+    returns the path or None if the node has not (yet) been created
+    """
+    try:
+        names = os.listdir(os.path.join(sysfs, sysname))
+    except OSError:
+        return None
+    for name in names:
+        if name.startswith('event'):
+            path = os.path.join(devices, name)
+            if os.path.exists(path):
+                return path
+    return None
+
+
 UINPUT_LOCATIONS = [
     '/dev/uinput',
     '/dev/input/uinput',
@@ -68,12 +163,13 @@ UINPUT_LOCATIONS = [
 
 
 class UInput(object):
+    # grow-only input_event array re-used by run_input_string, a device
+    # is driven by a single (session worker) thread
+    events = None
+
     def __init__(self):
         self.open_fd()
-        # Yes, this sucks, but it takes a while to be recognized
-        #  in fact this isn't long enough, as we see the
-        #  need to render a pause quite often on startup
-        time.sleep(0.01)
+        self.wait_ready()
 
     @property
     def our_device(self):
@@ -113,6 +209,40 @@ class UInput(object):
         if fcntl.ioctl(self.fd, UI_DEV_CREATE) < 0:
             raise RuntimeError('Unable to create virtual device')
 
+    def sysname(self):
+        """Get the kernel's name for our device (e.g. input42)
+
+        returns None if the kernel does not support UI_GET_SYSNAME
+        """
+        buffer = bytearray(SYSNAME_SIZE)
+        try:
+            fcntl.ioctl(self.fd, UI_GET_SYSNAME, buffer, True)
+        except OSError:
+            return None
+        return buffer.split(b'\000', 1)[0].decode('ascii')
+
+    def wait_ready(self, timeout=READY_TIMEOUT, interval=READY_POLL):
+        """Wait for the device's event node to be created after UI_DEV_CREATE
+
+        Keystrokes sent before the node exists are lost, so rather than
+        sleeping for a fixed time we poll for the node. Returns whether
+        the node was seen.
+        """
+        sysname = self.sysname()
+        if not sysname:
+            time.sleep(READY_FALLBACK)
+            return False
+        deadline = time.monotonic() + timeout
+        while True:
+            node = find_event_node(sysname)
+            if node:
+                log.debug('Virtual keyboard %s ready as %s', sysname, node)
+                return True
+            if time.monotonic() > deadline:
+                log.warning('Virtual keyboard %s did not become ready', sysname)
+                return False
+            time.sleep(interval)
+
     def _send_event(self, type=EV_KEY, code=65, value=1):
         event = input_event(type=type, code=code, value=value,)
         as_string = ctypes.string_at(ctypes.addressof(event), ctypes.sizeof(event))
@@ -203,9 +333,14 @@ class UInput(object):
         'META': 'LEFTMETA',
     }
 
+    TRANSLATION_TABLE = None
+    TRANSLATIONS = {}
+
     @classmethod
     def get_key_mapping(cls, force_rescan=False):
         if cls.KEY_MAPPING is None:
+            cls.TRANSLATION_TABLE = None
+            cls.TRANSLATIONS = {}
             if (not force_rescan) and os.path.exists(KEY_MAPPING_FILE):
                 cls.KEY_MAPPING = json.loads(open(KEY_MAPPING_FILE).read())
             else:
@@ -237,8 +372,11 @@ class UInput(object):
         return cls.KEY_MAPPING
 
     def close(self):
-        if fcntl.ioctl(self.fd, UI_DEV_DESTROY) < 0:
-            raise RuntimeError('Unable to cleanly shut down device')
+        try:
+            if fcntl.ioctl(self.fd, UI_DEV_DESTROY) < 0:
+                raise RuntimeError('Unable to cleanly shut down device')
+        finally:
+            os.close(self.fd)
 
     def char_translate(self, char):
         mapping = self.get_key_mapping()
@@ -250,69 +388,260 @@ class UInput(object):
         else:
             raise ValueError('Unrecognized key: %s', char)
 
-    def run_input_string(self, content):
-        strokes = self.parse_input_string(content)
-        for stroke in strokes:
-            if stroke:
-                with self.key_pressed(stroke):
-                    log.info('Sending: %s', stroke)
-                self.sync()
-            else:
+    def write_events(self, events, start=0, stop=None):
+        """Write events[start:stop] (an input_event array) in one write"""
+        if stop is None:
+            stop = len(events)
+        with memoryview(events) as view:
+            self.write_bytes(view.cast('B')[start * EVENT_SIZE : stop * EVENT_SIZE])
+
+    def translate(self, name):
+        """Cached char_translate, giving None for unrecognized keys"""
+        translations = self.TRANSLATIONS
+        if name in translations:
+            return translations[name]
+        try:
+            translated = self.char_translate(name)
+        except ValueError:
+            translated = None
+        # loading the key mapping may have replaced the cache
+        self.TRANSLATIONS[name] = translated
+        return translated
+
+    def get_translation_table(self):
+        """Dense char_translate table indexed by (ASCII) character code"""
+        table = self.TRANSLATION_TABLE
+        if table is None:
+            table = [self.translate(chr(code)) for code in range(TABLE_SIZE)]
+            self.__class__.TRANSLATION_TABLE = table
+        return table
+
+    def run_input_string(self, content, sync_group=1, pace=0.0, wait=None):
+        """Type content, see parse_input_string and compile_strokes
+
+        pace -- seconds to wait after each SYN_REPORT (i.e. after each
+                sync_group strokes), for applications which drop keys
+                that arrive too quickly
+        wait -- called with the seconds to wait for pauses and pacing,
+                if it returns True typing is abandoned, default
+                time.sleep
+
+        returns True if all of content was typed
+        """
+        wait = wait or time.sleep
+        events, batches = compile_strokes(
+            self.parse_input_string(content), sync_group=sync_group, events=self.events
+        )
+        self.events = events
+        for index, (start, stop) in enumerate(batches):
+            if index:
                 log.debug('Pausing')
-                time.sleep(0.1)
+                if wait(PAUSE_DURATION):
+                    return False
+            if pace:
+                for position in range(start, stop):
+                    if events[position].type == EV_SYN:
+                        self.write_events(events, start, position + 1)
+                        start = position + 1
+                        if wait(pace):
+                            return False
+            if stop > start:
+                log.debug('Sending %s events', stop - start)
+                self.write_events(events, start, stop)
+        return True
 
     def parse_input_string(self, content):
-        """Given an input string, produce set of things to send"""
+        """Given an input string, produce set of things to send
+
+        The string is split into tokens in a single pass, characters are
+        translated through the dense table (or the translation cache for
+        characters outside of it), so translation is linear in the length
+        of content.
+        """
         result = []
-        mapping = self.get_key_mapping()
-        while content:
-            if content.startswith('<>>'):
-                content = content[3:]
-                result.append(mapping['>'])
-            elif content.startswith('<<>'):
-                result.append(mapping['<'])
-                content = content[3:]
-            elif content.startswith('<'):
-                stop = content.index('>')
-                name = content[1:stop]
-                content = content[stop + 1 :]
-
-                if name == 'PAUSE':
-                    result.append([])
+        table = self.get_translation_table()
+        translate = self.translate
+        for token in INPUT_TOKENS.findall(content):
+            if len(token) == 1:
+                code = ord(token)
+                translated = table[code] if code < TABLE_SIZE else translate(token)
+                if translated is None:
+                    log.warning('Cannot type character: %s', token)
                 else:
-                    sub_result = []
-                    for element in name.split('+'):
-                        try:
-                            translated = self.char_translate(element)
-                            log.debug('%s => %s', element, translated)
-                            sub_result.extend(translated)
-                        except ValueError as err:
-                            log.warn('Could not type %s: %s', name, err)
-                    result.append(sub_result)
+                    result.append(translated)
+            elif token == '<<>':
+                result.append(table[ord('<')])
+            elif token == '<>>':
+                result.append(table[ord('>')])
+            elif token == '<PAUSE>':
+                result.append([])
             else:
-                # TODO: could allow strings-of-letters to be dictated
-                # in blocks (i.e. skip sync between them)
-                try:
-                    result.append(self.char_translate(content[0]))
-                except ValueError as err:
-                    log.warn('Cannot type character: %s', content[0])
-                content = content[1:]
-        log.info('Translated commands: %s', result)
+                name = token[1:-1]
+                sub_result = []
+                for element in name.split('+'):
+                    translated = translate(element)
+                    if translated is None:
+                        log.warning('Could not type %s: unrecognized %s', name, element)
+                    else:
+                        sub_result.extend(translated)
+                result.append(sub_result)
+        log.debug('Translated commands: %s', result)
         return result
 
 
+class UInputSession(object):
+    """Long-lived virtual keyboard which types requests from a queue
+
+    The device is created (and waited on) once when the session starts
+    and then re-used for every request, so there is no start-up pause
+    when typing the results of an utterance.
+
+    Requests are typed in order on the session's worker thread, callers
+    get a Future and never wait on the keystrokes being delivered.
+
+    sync_group -- passed to UInput.run_input_string
+    pace -- seconds between groups of keystrokes, see run_input_string
+    factory -- creates the device (for testing)
+    """
+
+    def __init__(self, sync_group=1, pace=0.0, factory=UInput):
+        self.sync_group = sync_group
+        self.pace = pace
+        self.factory = factory
+        self.device = None
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        # requests queued before the last cancel() are abandoned
+        self.generation = 0
+        self.interrupt = threading.Event()
+
+    def start(self):
+        """Start the worker (creating the device) if not yet running"""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        return self
+
+    def type(self, content):
+        """Queue content (see UInput.parse_input_string) for typing
+
+        returns a concurrent.futures.Future whose result is True once
+        content has been typed, or False if typing was interrupted by
+        cancel(), requests cancelled before they started are cancelled
+        """
+        future = Future()
+        with self.lock:
+            self.queue.put((self.generation, content, future))
+        self.start()
+        return future
+
+    def cancel(self):
+        """Stop typing the current request and abandon all queued requests"""
+        with self.lock:
+            self.generation += 1
+        self.interrupt.set()
+
+    def run(self):
+        """Create the device and type the queued requests until closed"""
+        try:
+            self.device = self.factory()
+        except Exception as err:
+            log.exception('Unable to create the virtual keyboard')
+            # fail the waiting requests, the next request retries the device
+            with self.lock:
+                self.thread = None
+                while True:
+                    try:
+                        request = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if request is not None:
+                        future = request[2]
+                        if future.set_running_or_notify_cancel():
+                            future.set_exception(err)
+            return
+        try:
+            while True:
+                request = self.queue.get()
+                if request is None:
+                    break
+                self.type_request(*request)
+        finally:
+            self.device.close()
+            self.device = None
+
+    def type_request(self, generation, content, future):
+        """Type a single request from our queue"""
+        self.interrupt.clear()
+        if generation != self.generation:
+            future.cancel()
+        if not future.set_running_or_notify_cancel():
+            log.debug('Skipping cancelled request %r', content)
+            return
+
+        def wait(seconds):
+            self.interrupt.wait(seconds)
+            return generation != self.generation
+
+        try:
+            result = self.device.run_input_string(
+                content, sync_group=self.sync_group, pace=self.pace, wait=wait,
+            )
+        except Exception as err:
+            log.exception('Unable to type %r', content)
+            future.set_exception(err)
+        else:
+            if not result:
+                log.info('Typing interrupted: %r', content)
+            future.set_result(result)
+
+    def close(self, timeout=None):
+        """Finish typing queued requests and destroy the device"""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join(timeout)
+
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def get_session():
+    """Get the (started) process-wide UInputSession"""
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = UInputSession()
+        return _SESSION.start()
+
+
+def cancel_typing():
+    """Stop typing in the process-wide UInputSession (if there is one)
+
+    The DBus service types through the process-wide session (TypeText)
+    and runs the interpreter, so its "stop typing" commands end up here.
+    """
+    session = _SESSION
+    if session is not None:
+        session.cancel()
+
+
 def main():
     logging.basicConfig(level=logging.DEBUG)
-    uinput = UInput()
+    session = get_session()
     if sys.argv[1:]:
         content = sys.argv[1:]
     else:
         content = ['''<PAUSE><alt+tab><PAUSE>#Hello world<ENTER><PAUSE><tab>#Boo!''']
     try:
         for phrase in content:
-            uinput.run_input_string(phrase)
+            session.type(phrase)
     finally:
-        uinput.close()
+        session.close()
 
 
 def rebuild_mapping():
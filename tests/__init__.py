@@ -1 +1,28 @@
 """Unit test package for listener."""
+import tempfile
+from unittest import mock
+from listener import ruleloader, defaults
+
+
+def temporary_rule_cache(case):
+    """Point the rule cache of test case at a temporary directory
+
+    returns the directory, which (with the in-process cache) is
+    discarded when the test finishes
+    """
+    directory = tempfile.TemporaryDirectory()
+    case.addCleanup(directory.cleanup)
+    patcher = mock.patch.multiple(ruleloader, RULE_CACHE=directory.name, _PARSED={})
+    patcher.start()
+    case.addCleanup(patcher.stop)
+    return directory.name
+
+
+def temporary_context_dir(case):
+    """Point the user's context/rules directory at a temporary directory"""
+    directory = tempfile.TemporaryDirectory()
+    case.addCleanup(directory.cleanup)
+    patcher = mock.patch.object(defaults, 'CONTEXT_DIR', directory.name)
+    patcher.start()
+    case.addCleanup(patcher.stop)
+    return directory.name
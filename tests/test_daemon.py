@@ -0,0 +1,502 @@
+import unittest, sys, types, queue, socket, threading, tempfile, os, time, io
+import collections
+from unittest import mock
+import numpy as np
+from listener import daemon, models, protocol, eventserver
+
+
+class FakeStream(object):
+    def __init__(self, model):
+        self.model = model
+        self.fed = 0
+
+    def feedAudioContent(self, audio):
+        self.fed += len(audio)
+
+    def finishStream(self):
+        self.model.warmed.append(self.fed)
+        return ''
+
+
+class FakeModel(object):
+    """Stands in for deepspeech.Model, recording its configuration"""
+
+    def __init__(self, path):
+        self.path = path
+        self.calls = []
+        self.warmed = []
+
+    def sampleRate(self):
+        return 16000
+
+    def setBeamWidth(self, beam_width):
+        self.calls.append(('beam_width', beam_width))
+
+    def enableExternalScorer(self, scorer):
+        self.calls.append(('scorer', scorer))
+
+    def disableExternalScorer(self):
+        self.calls.append(('scorer', None))
+
+    def createStream(self):
+        return FakeStream(self)
+
+
+def fake_deepspeech(model_class=FakeModel):
+    """Patch in a deepspeech module whose Model records the instances created"""
+    module = types.ModuleType('deepspeech')
+    module.models = []
+
+    def Model(path):
+        model = model_class(path)
+        module.models.append(model)
+        return model
+
+    module.Model = Model
+    return module
+
+
+Metadata = collections.namedtuple('Metadata', ('transcripts',))
+CandidateTranscript = collections.namedtuple(
+    'CandidateTranscript', ('tokens', 'confidence')
+)
+TokenMetadata = collections.namedtuple('TokenMetadata', ('text', 'start_time'))
+
+
+class LoudnessStream(FakeStream):
+    """Recognises speech as "loud" or "quiet", so each source is identifiable"""
+
+    peak = 0
+
+    def feedAudioContent(self, audio):
+        super(LoudnessStream, self).feedAudioContent(audio)
+        if len(audio):
+            self.peak = max(self.peak, int(np.abs(np.asarray(audio)).max()))
+
+    def metadata(self):
+        word = 'loud' if self.peak > 3000 else 'quiet'
+        tokens = [TokenMetadata(char, 0.0) for char in word]
+        return Metadata([CandidateTranscript(tokens, -1.0)])
+
+    intermediateDecodeWithMetadata = metadata
+
+    def finishStreamWithMetadata(self, count=1):
+        return self.metadata()
+
+
+class LoudnessModel(FakeModel):
+    def createStream(self):
+        return LoudnessStream(self)
+
+
+def speech(count, scale, rate=16000):
+    """count runs of voice-like buzzing (which webrtcvad detects) between silences"""
+    t = np.arange(int(rate * 1.5)) / rate
+    gap = np.zeros(int(rate * 0.8))
+    buzz = sum(np.sin(2 * np.pi * 120 * k * t) / k for k in range(1, 20))
+    voice = buzz * (0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)) * scale
+    return np.concatenate([gap] + [voice, gap] * count).astype(np.int16).tobytes()
+
+
+class TestModelRegistry(unittest.TestCase):
+    def setUp(self):
+        self.deepspeech = fake_deepspeech()
+        for patcher in [
+            mock.patch.dict(sys.modules, {'deepspeech': self.deepspeech}),
+            mock.patch.dict(daemon._MODELS, clear=True),
+            mock.patch.dict(daemon.MODEL_METRICS, clear=True),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_shared(self):
+        model = daemon.get_model('model.pbmm')
+        assert daemon.get_model('model.pbmm') is model
+        assert self.deepspeech.models == [model]
+        # warmed up once, with WARMUP_DURATION of audio
+        assert model.warmed == [int(16000 * daemon.WARMUP_DURATION)], model.warmed
+        metrics = daemon.MODEL_METRICS[('model.pbmm', None, None)]
+        assert sorted(metrics) == ['load_time', 'warmup_time'], metrics
+        assert all(value >= 0 for value in metrics.values()), metrics
+
+    def test_configuration(self):
+        default = daemon.get_model('model.pbmm')
+        assert default.calls == [('scorer', None)], default.calls
+        tuned = daemon.get_model('model.pbmm', beam_width=100, scorer='lm.scorer')
+        assert tuned is not default
+        assert tuned.calls == [('beam_width', 100), ('scorer', 'lm.scorer')]
+        assert daemon.get_model('model.pbmm', 100, 'lm.scorer') is tuned
+        assert len(self.deepspeech.models) == 2
+        assert len(daemon.MODEL_METRICS) == 2, daemon.MODEL_METRICS
+
+    def test_load_model_options(self):
+        options = daemon.get_options().parse_args(
+            ['--model', 'model.pbmm', '--beam-width', '50']
+        )
+        model = daemon.load_model(options)
+        assert daemon.get_model('model.pbmm', 50) is model
+        assert daemon.load_model(options) is model
+
+    def test_connected_message(self):
+        options = daemon.get_options().parse_args(['--model', 'model.pbmm'])
+        out_queue = queue.Queue()
+        with mock.patch.object(daemon, 'run_recognition') as run_recognition:
+            daemon.process_input_file(
+                None, options, out_queue, background=False, stream_id='audio-0'
+            )
+        assert run_recognition.call_count == 1
+        message = out_queue.get_nowait()
+        assert not message['final'] and not message['partial'], message
+        assert message['stream_id'] == 'audio-0'
+        connected, loaded = message['messages']
+        assert connected == 'Connected'
+        assert loaded.startswith('Model loaded in '), loaded
+        # 'messages' is the Utterance field clients read
+        assert models.Utterance(**message).messages == message['messages']
+
+
+class TestPartialScheduler(unittest.TestCase):
+    def setUp(self):
+        # 100 samples/s so that interval * rate is easy to reason about
+        self.scheduler = daemon.PartialScheduler(
+            rate=100, target_latency=0.25, max_latency=2.0, headroom=2.0
+        )
+
+    def decode(self, duration):
+        """Feed speech until the next decode is due, then decode in duration"""
+        scheduler = self.scheduler
+        fed = 0
+        while not scheduler.due():
+            scheduler.feed(5)
+            fed += 5
+            assert fed <= 1000, 'Decode never came due'
+        scheduler.decoded(duration)
+        return fed
+
+    def test_due(self):
+        scheduler = self.scheduler
+        assert not scheduler.due()
+        scheduler.feed(20)
+        assert not scheduler.due()
+        scheduler.feed(5)
+        assert scheduler.due()
+        scheduler.decoded(0.01)
+        assert not scheduler.due()
+        assert scheduler.interval == 0.25
+
+    def test_silence_not_due(self):
+        scheduler = self.scheduler
+        scheduler.feed(100, is_speech=False)
+        assert not scheduler.due()
+        scheduler.feed(5)
+        assert scheduler.due()
+
+    def test_disabled(self):
+        scheduler = daemon.PartialScheduler(rate=100, target_latency=0)
+        scheduler.feed(1000)
+        assert not scheduler.due()
+
+    def test_headroom(self):
+        # decode took 0.2s of the 0.25s covered, keep decoding to 1/2 real time
+        assert self.decode(0.2) == 25
+        assert self.scheduler.interval == 0.4, self.scheduler.interval
+        assert self.decode(0.2) == 40
+
+    def test_backoff(self):
+        intervals = []
+        for _ in range(5):
+            # every decode is slower than the audio it covered
+            fed = self.decode(self.scheduler.interval * 2)
+            assert fed == round(intervals[-1] * 100 if intervals else 25)
+            intervals.append(self.scheduler.interval)
+        assert intervals == [0.5, 1.0, 2.0, 2.0, 2.0], intervals
+
+    def test_recovery(self):
+        for _ in range(3):
+            self.decode(self.scheduler.interval * 2)
+        assert self.scheduler.interval == 2.0
+        intervals = []
+        for _ in range(20):
+            self.decode(0.01)
+            intervals.append(self.scheduler.interval)
+        assert intervals == sorted(intervals, reverse=True), intervals
+        assert intervals[0] < 2.0, intervals
+        assert intervals[-1] == 0.25, intervals
+
+    def test_reset(self):
+        for _ in range(3):
+            self.decode(self.scheduler.interval * 2)
+        self.scheduler.reset(50)
+        assert self.scheduler.interval == 0.25
+        assert self.scheduler.cost is None
+        assert not self.scheduler.due()
+        self.scheduler.feed(25)
+        assert self.scheduler.due()
+
+
+def partial(words, starts):
+    """Partial transcript json with one character token per letter"""
+    tokens, token_starts = [], []
+    for word, start in zip(words, starts):
+        if tokens:
+            tokens.append(' ')
+            token_starts.append(start)
+        tokens.extend(word)
+        token_starts.extend([start] * len(word))
+    return {
+        'partial': True,
+        'final': False,
+        'tokens': tokens,
+        'starts': token_starts,
+        'words': words,
+        'word_starts': starts,
+        'confidence': -3.5,
+        'text': ' '.join(words),
+    }
+
+
+class TestStablePrefix(unittest.TestCase):
+    def test_empty(self):
+        assert daemon.stable_prefix([]) == []
+        assert daemon.stable_prefix([[]]) == []
+        assert daemon.stable_prefix([['hello'], []]) == []
+
+    def test_agree(self):
+        assert daemon.stable_prefix([['hello', 'world']] * 3) == ['hello', 'world']
+
+    def test_shorter(self):
+        assert daemon.stable_prefix(
+            [['hello'], ['hello', 'world'], ['hello', 'world', 'there']]
+        ) == ['hello']
+
+    def test_divergent(self):
+        assert daemon.stable_prefix(
+            [['hello', 'world', 'there'], ['hello', 'word', 'there']]
+        ) == ['hello']
+        assert daemon.stable_prefix([['hello', 'world'], ['yellow', 'world']]) == []
+
+
+class TestCommitToJson(unittest.TestCase):
+    def setUp(self):
+        self.partial = partial(['this', 'is', 'a', 'test'], [0.0, 0.5, 0.8, 1.2])
+
+    def test_commit(self):
+        committed = daemon.commit_to_json(self.partial, 2, 0.8)
+        assert committed['final'] and not committed['partial']
+        (transcript,) = committed['transcripts']
+        assert transcript['final'] and not transcript['partial']
+        assert transcript['words'] == ['this', 'is']
+        assert transcript['word_starts'] == [0.0, 0.5]
+        assert transcript['text'] == 'this is'
+        assert transcript['confidence'] == -3.5
+        # tokens up to (not including) the restart offset, so the separator
+        # before the first uncommitted word is dropped along with it
+        assert ''.join(transcript['tokens']) == 'this is', transcript['tokens']
+        assert all(start < 0.8 for start in transcript['starts'])
+        assert len(transcript['starts']) == len(transcript['tokens'])
+
+    def test_restart_offset(self):
+        (transcript,) = daemon.commit_to_json(self.partial, 3, 1.2)['transcripts']
+        assert transcript['words'] == ['this', 'is', 'a']
+        assert ''.join(transcript['tokens']) == 'this is a'
+        (transcript,) = daemon.commit_to_json(self.partial, 1, 0.0)['transcripts']
+        assert transcript['words'] == ['this']
+        assert transcript['tokens'] == [] and transcript['starts'] == []
+
+    def test_empty(self):
+        empty = partial([], [])
+        (transcript,) = daemon.commit_to_json(empty, 0, 0.0)['transcripts']
+        assert transcript['words'] == [] and transcript['tokens'] == []
+        assert transcript['text'] == ''
+
+
+class TestServeStreams(unittest.TestCase):
+    def setUp(self):
+        self.deepspeech = fake_deepspeech(LoudnessModel)
+        for patcher in [
+            mock.patch.dict(sys.modules, {'deepspeech': self.deepspeech}),
+            mock.patch.dict(daemon._MODELS, clear=True),
+            mock.patch.dict(daemon.MODEL_METRICS, clear=True),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.sockname = os.path.join(directory.name, 'audio')
+
+    def connect(self):
+        deadline = time.monotonic() + 5
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.sockname)
+                return sock
+            except (FileNotFoundError, ConnectionRefusedError):
+                sock.close()
+                assert time.monotonic() < deadline, 'Daemon never listened'
+                time.sleep(0.01)
+
+    def send(self, sock, audio):
+        with sock:
+            sock.sendall(audio)
+            sock.shutdown(socket.SHUT_WR)
+
+    def test_two_streams(self):
+        options = daemon.get_options().parse_args(
+            ['--model', 'model.pbmm', '--unix-socket', self.sockname, '--streams', '2']
+        )
+        out_queue = queue.Queue()
+        # serve_streams accepts forever, the daemon thread is abandoned
+        server = threading.Thread(
+            target=daemon.serve_streams, args=(options, out_queue), daemon=True
+        )
+        server.start()
+        senders = [
+            threading.Thread(target=self.send, args=(self.connect(), audio))
+            for audio in (speech(2, 3000), speech(2, 600))
+        ]
+        for sender in senders:
+            sender.start()
+        events = collections.defaultdict(list)
+        while sum(event['final'] for event in sum(events.values(), [])) < 4:
+            event = out_queue.get(timeout=10)
+            events[event.get('stream_id')].append(event)
+        for sender in senders:
+            sender.join(5)
+        assert sorted(events) == ['stream-0', 'stream-1'], list(events)
+        assert len(self.deepspeech.models) == 1, 'Model not shared'
+        for stream_id, expected in [('stream-0', 'loud'), ('stream-1', 'quiet')]:
+            connected = events[stream_id][0]
+            assert connected['messages'][0] == 'Connected', connected
+            finals = [event for event in events[stream_id] if event['final']]
+            assert len(finals) == 2, (stream_id, events[stream_id])
+            words = set(
+                word
+                for event in events[stream_id][1:]
+                for word in event['transcripts'][0]['words']
+            )
+            assert words == {expected}, (stream_id, words)
+
+
+def stub_metadata(text, confidence=-2.0):
+    """DeepSpeech-like Metadata with one token per character of text"""
+    tokens = [TokenMetadata(char, 0.1 * index) for index, char in enumerate(text)]
+    return Metadata([CandidateTranscript(tokens, confidence)])
+
+
+def decode(encoded, format):
+    """Decode the buffers from encode_event, checking the framing"""
+    if format == protocol.LEGACY:
+        body, terminator = encoded
+        assert terminator == protocol.TERMINATOR
+        assert protocol.TERMINATOR not in body
+        return protocol.loads(body)
+    header, body = encoded
+    code, length = protocol.HEADER.unpack(header)
+    assert protocol.FORMAT_NAMES[code] == format
+    assert length == len(body)
+    return protocol.loads(body, format)
+
+
+class TestEventEncoding(unittest.TestCase):
+    """The json-compatible events and their encoding on the wire"""
+
+    TRANSCRIPT_KEYS = {'partial', 'final', 'words', 'confidence', 'text'}
+    TIMING_KEYS = set(daemon.TIMING_KEYS)
+
+    def test_transcript_to_json(self):
+        (transcript,) = stub_metadata(' hello  world').transcripts
+        struct = daemon.transcript_to_json(transcript)
+        assert set(struct) == self.TRANSCRIPT_KEYS | self.TIMING_KEYS, struct
+        assert struct['words'] == ['hello', 'world'], struct
+        assert struct['text'] == ' hello  world'
+        assert struct['confidence'] == -2.0
+        assert struct['tokens'] == list(' hello  world')
+        assert struct['word_starts'] == [0.1, 0.8], struct['word_starts']
+        assert len(struct['starts']) == len(struct['tokens'])
+        partial = daemon.transcript_to_json(transcript, partial=True, timing=False)
+        assert set(partial) == self.TRANSCRIPT_KEYS, partial
+        assert partial['partial'] and not partial['final']
+
+    def test_without_timing(self):
+        metadata = daemon.metadata_to_json(stub_metadata('hello world'), partial=True)
+        stripped = daemon.without_timing(metadata)
+        assert set(stripped['transcripts'][0]) == self.TRANSCRIPT_KEYS
+        # the original (used for the stability commits) keeps its timing
+        assert set(metadata['transcripts'][0]) == (
+            self.TRANSCRIPT_KEYS | self.TIMING_KEYS
+        )
+        assert stripped['partial'] and 'utterance_number' not in stripped
+
+    def test_wire_format(self):
+        partial = daemon.metadata_to_json(
+            stub_metadata('hello wor'), partial=True, timing=False
+        )
+        final = daemon.metadata_to_json(stub_metadata('hello world'))
+        for format in protocol.available_formats() + [protocol.LEGACY]:
+            for record, event_keys, transcript_keys in [
+                (partial, {'partial', 'final', 'transcripts'}, self.TRANSCRIPT_KEYS),
+                (
+                    final,
+                    {'partial', 'final', 'transcripts', 'utterance_number'},
+                    self.TRANSCRIPT_KEYS | self.TIMING_KEYS,
+                ),
+            ]:
+                decoded = decode(eventserver.encode_event(record, format), format)
+                assert decoded == record, (format, decoded)
+                assert set(decoded) == event_keys, (format, decoded)
+                assert set(decoded['transcripts'][0]) == transcript_keys
+
+    def test_utterance_wire_format(self):
+        """Utterances (e.g. re-sent by the interpreter) exclude the same keys"""
+        utterance_keys = set(models.Utterance.__fields__)
+        transcript_keys = set(models.Transcript.__fields__) - {'rule_matches'}
+        for partial in (True, False):
+            metadata = daemon.metadata_to_json(stub_metadata('hello world'), partial)
+            utterance = models.Utterance(**metadata)
+            expected = transcript_keys - (self.TIMING_KEYS if partial else set())
+            for format in protocol.available_formats() + [protocol.LEGACY]:
+                decoded = decode(eventserver.encode_event(utterance, format), format)
+                assert set(decoded) == utterance_keys, (format, decoded)
+                assert set(decoded['transcripts'][0]) == expected, (format, decoded)
+                assert decoded['transcripts'][0]['words'] == ['hello', 'world']
+                assert models.Utterance(**decoded).partial == partial
+
+
+class RealTimeAudio(io.BytesIO):
+    """Audio source whose clock advances with the audio read from it"""
+
+    clock = 0.0
+
+    def readinto(self, buffer):
+        count = super(RealTimeAudio, self).readinto(buffer)
+        self.clock += count / 2 / 16000
+        return count
+
+
+class TestTimings(unittest.TestCase):
+    def test_speech_end(self):
+        """The audio stamp is the end of speech, not the start of the utterance"""
+        # 0.8s silence, 1.5s speech, 0.8s silence
+        source = RealTimeAudio(speech(1, 3000))
+        clock = types.SimpleNamespace(
+            monotonic=lambda: source.clock, time=time.time, sleep=time.sleep
+        )
+        events = []
+        with mock.patch.object(daemon, 'time', clock):
+            try:
+                for event in daemon.iter_metadata(LoudnessModel('model'), source):
+                    events.append(event)
+            except IOError:
+                pass
+        finals = [event for event in events if event['final']]
+        assert len(finals) == 1, events
+        timings = finals[0]['timings']
+        # speech ends at 2.3s (the vad hangs over by a few frames)
+        assert 2.0 < timings['audio'] < 2.6, timings
+        # just the time taken to detect the trailing silence
+        assert 0 < timings['vad'] - timings['audio'] < 0.5, timings
+        partials = [event for event in events if event['partial']]
+        assert partials, events
+        for event in partials:
+            assert 0.8 <= event['timings']['audio'] <= event['timings']['decoded']
@@ -7,6 +7,7 @@ from listener import (
     defaults,
     fuzzymatching,
 )
+from tests import temporary_rule_cache
 
 log = logging.getLogger(__name__)
 
@@ -19,6 +20,9 @@ def has_rule(match, rules):
 
 
 class TestInterpreter(unittest.TestCase):
+    def setUp(self):
+        temporary_rule_cache(self)
+
     def test_fuzzy_matching(self):
         rules, ruleset = ruleloader.load_rules('code')
         table = fuzzymatching.fuzzy_lookup_table(ruleset)
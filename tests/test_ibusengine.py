@@ -0,0 +1,132 @@
+import unittest, threading
+from unittest import mock
+from listener import models, ibusengine
+
+ListenerEngine = ibusengine.ListenerEngine
+
+
+class FakeEngine(object):
+    """The preedit/commit logic of ListenerEngine without an IBus connection"""
+
+    no_space = False
+    preedit = ''
+    pending_preedit = None
+    preedit_timer = None
+
+    on_decoding_event = ListenerEngine.on_decoding_event
+    format_words = ListenerEngine.format_words
+    schedule_preedit = ListenerEngine.schedule_preedit
+    flush_preedit = ListenerEngine.flush_preedit
+    first_transcript = ListenerEngine.first_transcript
+
+    def __init__(self):
+        self.preedit_lock = threading.Lock()
+        self.calls = []
+
+    def update_preedit_text(self, text, cursor, visible):
+        self.calls.append(('preedit', text.get_text(), cursor, visible))
+
+    def commit_text(self, text):
+        self.calls.append(('commit', text.get_text()))
+
+
+def event(words, partial=False):
+    return models.Utterance(
+        partial=partial,
+        final=not partial,
+        transcripts=[
+            models.Transcript(words=words, partial=partial, final=not partial)
+        ],
+    )
+
+
+class TestPreedit(unittest.TestCase):
+    def setUp(self):
+        self.engine = FakeEngine()
+        self.timers = []
+        patcher = mock.patch.object(
+            ibusengine.GLib, 'timeout_add', side_effect=self.timeout_add
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def timeout_add(self, interval, callback):
+        self.timers.append((interval, callback))
+        return len(self.timers)
+
+    def run_timers(self):
+        timers, self.timers = self.timers, []
+        for interval, callback in timers:
+            assert interval == ibusengine.PREEDIT_INTERVAL
+            assert callback() is False, 'Preedit timeout should be one-shot'
+
+    def test_format_words(self):
+        engine = self.engine
+        assert engine.format_words([]) == ('', False)
+        assert engine.format_words(['hello', 'there']) == (' hello there', False)
+        assert engine.format_words(['hello', '^', 'there', '^']) == (
+            ' hellothere',
+            True,
+        )
+        # non-text "words" are key-presses, after which no space is needed
+        assert engine.format_words(['hello', ('ctrl', 'c'), 'there']) == (
+            ' hellothere',
+            False,
+        )
+        engine.no_space = True
+        assert engine.format_words(['hello']) == ('hello', False)
+
+    def test_schedule_coalesces(self):
+        engine = self.engine
+        engine.schedule_preedit(' hello')
+        engine.schedule_preedit(' hello there')
+        assert len(self.timers) == 1, self.timers
+        assert engine.calls == []
+        self.run_timers()
+        assert engine.calls == [('preedit', ' hello there', 12, True)], engine.calls
+        assert engine.preedit == ' hello there'
+        assert engine.preedit_timer is None
+
+    def test_flush_unchanged(self):
+        engine = self.engine
+        engine.schedule_preedit(' hello')
+        self.run_timers()
+        engine.schedule_preedit(' hello')
+        self.run_timers()
+        # nothing pending, e.g. cancelled by a final
+        assert engine.flush_preedit() is False
+        assert engine.calls == [('preedit', ' hello', 6, True)], engine.calls
+
+    def test_partials_then_final(self):
+        engine = self.engine
+        engine.on_decoding_event(event(['hello'], partial=True))
+        engine.on_decoding_event(event(['hello', 'there'], partial=True))
+        self.run_timers()
+        engine.on_decoding_event(event(['hello', 'there', ',', '^'], partial=True))
+        engine.on_decoding_event(event(['hello', 'there', ',', '^']))
+        # the final cancels the pending partial
+        self.run_timers()
+        assert engine.calls == [
+            ('preedit', ' hello there', 12, True),
+            ('preedit', '', 0, False),
+            ('commit', ' hello there ,'),
+        ], engine.calls
+        assert engine.no_space
+        assert engine.preedit == ''
+
+    def test_final_without_preedit(self):
+        engine = self.engine
+        engine.on_decoding_event(event(['hello']))
+        engine.on_decoding_event(event(['there']))
+        assert self.timers == []
+        assert engine.calls == [
+            ('commit', ' hello'),
+            ('commit', ' there'),
+        ], engine.calls
+
+    def test_empty_events(self):
+        engine = self.engine
+        engine.on_decoding_event(models.Utterance(partial=True, final=False))
+        engine.on_decoding_event(models.Utterance())
+        assert self.timers == []
+        assert engine.calls == []
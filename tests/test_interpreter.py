@@ -1,4 +1,4 @@
-import unittest
+import unittest, os, random
 from listener import (
     interpreter,
     ruleloader,
@@ -6,6 +6,7 @@ from listener import (
     models,
     defaults,
 )
+from tests import temporary_rule_cache, temporary_context_dir
 
 
 def list_in_list(search, env):
@@ -32,9 +33,57 @@ class FakeInterpreter(object):
     def start_listening(self):
         self.context = defaults.DEFAULT_CONTEXT
 
+    def stop_typing(self):
+        self.typing = False
+
+
+class RulesContext(object):
+    """Just enough of a Context to apply a rule-set"""
+
+    def __init__(self, name):
+        self.name = name
+        rules, self.ruleset = ruleloader.load_rules(name)
+        self.automaton = models.compile_rules(rules)
+
+
+class FakeContext(object):
+    closed = False
+
+    def __init__(self, name):
+        self.name = name
+
+    def preload(self):
+        return self
+
+    def close(self):
+        self.closed = True
+
+
+def full_rescan(words, rules, interpreter=None):
+    """Reference apply_rules which rescans the whole transcript on every pass"""
+    working = models.compress_no_spaces(words)
+    for iteration in range(20):
+        starting = working[:]
+        position = 0
+        while True:
+            match = next(models.iter_matches(working, rules, position), None)
+            if match is None:
+                break
+            try:
+                transformed = match.rule(match, interpreter=interpreter)
+            except StopIteration:
+                transformed = []
+            working[match.start_index : match.stop_index] = transformed
+            position = match.start_index + len(transformed)
+        working = models.compress_no_spaces(working)
+        if working == starting:
+            break
+    return working
+
 
 class TestInterpreter(unittest.TestCase):
     def setUp(self):
+        self.rule_cache = temporary_rule_cache(self)
         self.interpreter = FakeInterpreter()
 
     def test_loading(self):
@@ -45,6 +94,16 @@ class TestInterpreter(unittest.TestCase):
             assert rule.match
             assert rule.target
 
+    def test_rule_cache(self):
+        rules, ruleset = ruleloader.load_rules('code')
+        assert os.listdir(self.rule_cache)
+        ruleloader._PARSED.clear()
+        cached, cached_set = ruleloader.load_rules('code')
+        assert [rule.format() for rule in cached_set] == [
+            rule.format() for rule in ruleset
+        ]
+        assert [rule.text for rule in cached_set] == [rule.text for rule in ruleset]
+
     def test_text_expansion(self):
         rules, ruleset = ruleloader.load_rules('default')
         for rule in ruleset:
@@ -87,6 +146,110 @@ class TestInterpreter(unittest.TestCase):
             result = models.words_to_text(words)
             assert result == expected, (spoken, result)
 
+    def test_stop_typing_scope(self):
+        """Only the typing rules treat "scratch that" as a command"""
+        for name in ('default', 'code'):
+            rules, ruleset = ruleloader.load_rules(name)
+            transcript = models.Transcript(words=['scratch', 'that'])
+            words = models.apply_rules(transcript, rules, interpreter=self.interpreter)
+            assert words == ['scratch', 'that'], (name, words)
+        rules, ruleset = ruleloader.load_rules('typing')
+        self.interpreter.typing = True
+        transcript = models.Transcript(words=['hello', 'scratch', 'that'])
+        words = models.apply_rules(transcript, rules, interpreter=self.interpreter)
+        assert words == ['hello'], words
+        assert self.interpreter.typing is False
+
+    def test_phrase_after_start(self):
+        rules, ruleset = ruleloader.load_rules('code')
+        automaton = models.compile_rules(rules)
+        words = 'this is all caps hello there'.split(' ')
+        match = models.match_rules(words, automaton)
+        assert match.start_index == 2, match
+        assert match.stop_index == len(words), match
+        assert match.var_phrase == ['hello', 'there'], match.var_phrase
+
+    def test_context_pool(self):
+        loaded = []
+
+        def factory(name):
+            loaded.append(name)
+            return FakeContext(name)
+
+        pool = context.ContextPool(size=2, factory=factory)
+        first = pool.get('first')
+        assert pool.get('first') is first
+        pool.preload(['second', 'first'])
+        second = pool.get('second')
+        assert loaded == ['first', 'second'], loaded
+        pool.get('third')
+        assert first.closed, 'Least-recently-used context not closed'
+        assert not second.closed
+        assert list(pool.contexts) == ['second', 'third']
+
+    def test_partial_preview(self):
+        core = interpreter.Context.by_name('english-general')
+        preview = interpreter.PreviewInterpreter(self.interpreter)
+        spoken = 'hello there comma stop listening open paren this close paren'
+        spoken = spoken.split(' ')
+        for count in range(1, len(spoken) + 1):
+            utt = models.Utterance(
+                partial=True,
+                final=False,
+                transcripts=[models.Transcript(words=spoken[:count])],
+            )
+            full = core.apply_rules(utt.copy(deep=True), interpreter=preview)
+            result = preview.process_partial(core, utt)
+            assert result.transcripts[0].words == full.transcripts[0].words, (
+                spoken[:count],
+                result.transcripts[0].words,
+            )
+        assert preview.prefix, 'Did not cache the stable prefix'
+        assert self.interpreter.context is None, 'Ran a command on a partial'
+
+    def test_partial_preview_random(self):
+        """Previews of growing/revised partials match interpreting them whole"""
+        generator = random.Random(42)
+        directory = os.path.join(os.path.dirname(ruleloader.__file__), 'rulesets')
+        names = sorted(
+            filename[: -len('.rules')]
+            for filename in os.listdir(directory)
+            if filename.endswith('.rules')
+        )
+        preview = interpreter.PreviewInterpreter(self.interpreter)
+        for name in names:
+            core = RulesContext(name)
+            vocabulary = sorted(
+                set(
+                    word
+                    for rule in core.ruleset
+                    for word in rule.match
+                    if word not in (defaults.WORD_MARKER, defaults.PHRASE_MARKER)
+                )
+            ) + ['moo', 'there', 'and']
+            for trial in range(100):
+                preview.reset()
+                words = []
+                for step in range(12):
+                    if words and generator.random() < 0.2:
+                        # the recogniser revised the last word
+                        words[-1] = generator.choice(vocabulary)
+                    else:
+                        words.append(generator.choice(vocabulary))
+                    utt = models.Utterance(
+                        partial=True,
+                        final=False,
+                        transcripts=[models.Transcript(words=words[:])],
+                    )
+                    expected = preview.interpret(core, utt, words[:])
+                    result = preview.process_partial(core, utt)
+                    assert result.transcripts[0].words == expected, (
+                        name,
+                        words,
+                        result.transcripts[0].words,
+                        expected,
+                    )
+
     def test_context_loading(self):
         core = interpreter.Context.by_name('english-general')
 
@@ -124,6 +287,178 @@ class TestInterpreter(unittest.TestCase):
             )
 
 
+class TestApplyRules(unittest.TestCase):
+    """The incremental (windowed rescan) rule application"""
+
+    RULES = """
+deux => 'two'
+un => 'one'
+quatre => 'four'
+foo => 'bar'
+yell => ['all', 'caps']
+one two three four => 'counted'
+alpha bar => 'upstream'
+all caps ${phrase} => all_caps()
+"""
+
+    def setUp(self):
+        temporary_rule_cache(self)
+        contexts = temporary_context_dir(self)
+        with open(os.path.join(contexts, 'windows.rules'), 'w') as fh:
+            fh.write(self.RULES)
+        rules, self.ruleset = ruleloader.load_rules('windows')
+        self.automaton = models.compile_rules(rules)
+
+    def apply(self, spoken):
+        history = []
+        words = models.apply_rules(
+            models.Transcript(words=spoken.split(' ')), self.automaton, history=history
+        )
+        assert words == full_rescan(spoken.split(' '), self.automaton), spoken
+        return words, history
+
+    def test_match_past_window_stop(self):
+        """A match starting in a rescan window may extend beyond it"""
+        words, history = self.apply('x un two three four y')
+        assert words == ['x', 'counted', 'y'], words
+        assert history[1] == ['x', 'one', 'two', 'three', 'four', 'y'], history
+
+    def test_match_before_change(self):
+        """A rewrite completes a match starting max_depth words before it"""
+        words, history = self.apply('x y one two three deux')
+        assert words == ['x', 'y', 'one', 'two', 'three', 'two'], words
+        words, history = self.apply('x y one two three quatre')
+        assert words == ['x', 'y', 'counted'], words
+        words, history = self.apply('x one two three four deux')
+        assert words == ['x', 'counted', 'two'], words
+
+    def test_upstream_match(self):
+        """A rewritten word matches together with the words before it"""
+        words, history = self.apply('alpha foo')
+        assert words == ['upstream'], words
+        assert len(history) == 4, history
+        words, history = self.apply('x alpha alpha foo y')
+        assert words == ['x', 'alpha', 'upstream', 'y'], words
+
+    def test_phrase(self):
+        """${phrase} consumes the rest of the transcript, past the window"""
+        words, history = self.apply('say yell hello there un deux')
+        assert history[1] == ['say', 'all', 'caps', 'hello', 'there', 'one', 'two']
+        assert words == ['say', 'HELLO', 'THERE', 'ONE', 'TWO'], words
+        # rules are not re-applied inside the captured phrase
+        words, history = self.apply('all caps foo bar')
+        assert words == ['FOO', 'BAR'], words
+
+    def test_full_rescan_equivalent(self):
+        """Incremental application matches rescanning everything, on random input"""
+        generator = random.Random(7)
+        directory = os.path.join(os.path.dirname(ruleloader.__file__), 'rulesets')
+        names = sorted(
+            filename[: -len('.rules')]
+            for filename in os.listdir(directory)
+            if filename.endswith('.rules')
+        )
+        for name in names:
+            core = RulesContext(name)
+            vocabulary = sorted(
+                set(
+                    word
+                    for rule in core.ruleset
+                    for word in rule.match
+                    if word not in (defaults.WORD_MARKER, defaults.PHRASE_MARKER)
+                )
+            ) + ['moo', 'there', 'and', '^']
+            for trial in range(100):
+                words = [
+                    generator.choice(vocabulary)
+                    for i in range(generator.randint(0, 15))
+                ]
+                result = models.apply_rules(
+                    models.Transcript(words=words[:]),
+                    core.automaton,
+                    interpreter=FakeInterpreter(),
+                )
+                expected = full_rescan(words[:], core.automaton, FakeInterpreter())
+                assert result == expected, (name, words, result, expected)
+
+
+class TestBoosts(unittest.TestCase):
+    """Rule boosts and hotwords merged in Context.boost_index"""
+
+    RULES = """
+open paren => '(' +2
+open file => 'open()' +1
+close paren => ')'
+"""
+
+    def setUp(self):
+        temporary_rule_cache(self)
+        contexts = temporary_context_dir(self)
+        with open(os.path.join(contexts, 'boosted.rules'), 'w') as fh:
+            fh.write(self.RULES)
+
+    def context(self):
+        return context.Context(
+            name='boosted', config=models.ContextDefinition(rules='boosted')
+        )
+
+    def expected(self, core, words):
+        """The boost as summed separately from the rules and hotwords"""
+        return sum(
+            core.boosts.get(word, 0) + core.hotwords.get(word, 0) for word in words
+        )
+
+    def score(self, core):
+        event = models.Utterance(
+            transcripts=[
+                models.Transcript(words=['open', 'paren'], confidence=0.0),
+                models.Transcript(words=['oven', 'pan'], confidence=3.0),
+                models.Transcript(words=['close', 'file'], confidence=1.0),
+            ]
+        )
+        original = dict(
+            (tuple(transcript.words), transcript.confidence)
+            for transcript in event.transcripts
+        )
+        core.score(event)
+        for transcript in event.transcripts:
+            expected = original[tuple(transcript.words)]
+            expected += self.expected(core, transcript.words)
+            assert transcript.confidence == expected, transcript
+        return [' '.join(transcript.words) for transcript in event.transcripts]
+
+    def test_boosts(self):
+        core = self.context()
+        assert core.boosts == {'open': 2, 'paren': 2, 'file': 1, 'close': 1}
+        assert self.score(core) == ['open paren', 'oven pan', 'close file']
+
+    def test_hotwords_before_index(self):
+        core = self.context()
+        assert '__boost_index_value' not in core.__dict__
+        core.add_hotwords({'pan': 2.0, 'open': -0.5})
+        assert core.boost_index == {
+            'open': 1.5,
+            'paren': 2,
+            'file': 1,
+            'close': 1,
+            'pan': 2.0,
+        }
+        assert self.score(core) == ['oven pan', 'open paren', 'close file']
+
+    def test_hotwords_after_index(self):
+        core = self.context()
+        assert self.score(core) == ['open paren', 'oven pan', 'close file']
+        core.add_hotwords({'pan': 2.0, 'open': -0.5})
+        assert self.score(core) == ['oven pan', 'open paren', 'close file']
+        # hotwords accumulate, replacing earlier hotword values
+        core.add_hotwords({'open': 1.5, 'file': 3.0})
+        assert core.boost_index['open'] == 3.5
+        assert self.score(core) == ['close file', 'open paren', 'oven pan']
+        rebuilt = self.context()
+        rebuilt.add_hotwords(dict(core.hotwords))
+        assert rebuilt.boost_index == core.boost_index
+
+
 JUNK_UTTERANCE = utt = models.Utterance(
     partial=False,
     final=True,
@@ -0,0 +1,143 @@
+import unittest, sys, types, os, tempfile
+from unittest import mock
+from listener import kenlmscorer, models
+
+
+class State(object):
+    def __init__(self):
+        self.words = ()
+
+
+class FakeModel(object):
+    """Deterministic stand-in for a kenlm.Model (trigram-ish scores)"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def probability(self, history, word):
+        return -((len(word) * 7 + sum(len(w) for w in history[-2:])) % 11) / 4.0
+
+    def BeginSentenceWrite(self, state):
+        state.words = ('<s>',)
+
+    def BaseScore(self, state, word, out):
+        self.calls += 1
+        out.words = state.words + (word,)
+        return self.probability(state.words, word)
+
+    def score(self, text, bos=True, eos=True):
+        history = ('<s>',)
+        total = 0.0
+        for word in text.split() + ['</s>']:
+            total += self.probability(history, word)
+            history += (word,)
+        return total
+
+
+FAKE_KENLM = types.ModuleType('kenlm')
+FAKE_KENLM.State = State
+
+
+class TestKenLMScorer(unittest.TestCase):
+    def setUp(self):
+        self.model = FakeModel()
+        self.scorer = kenlmscorer.KenLMScorer()
+        self.scorer.__dict__['__scorer_value'] = self.model
+        patcher = mock.patch.dict(sys.modules, {'kenlm': FAKE_KENLM})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_score_texts(self):
+        texts = [
+            'open the file',
+            'open the files',
+            'open a file',
+            'open the file',
+            '',
+            'close it now please',
+        ]
+        scores = self.scorer.score_texts(texts)
+        expected = [self.model.score(text) for text in texts]
+        assert scores == expected, (scores, expected)
+
+    def test_shares_prefixes(self):
+        self.scorer.score_texts(['open the file', 'open the files'])
+        # open, the, file, files and two end-of-sentence scores
+        assert self.model.calls == 6, self.model.calls
+
+    def test_score(self):
+        utterance = models.Utterance(
+            transcripts=[
+                models.Transcript(text='open the file', confidence=1.0),
+                models.Transcript(text='open a file', confidence=2.0),
+            ]
+        )
+        self.scorer.score(utterance)
+        assert [t.confidence for t in utterance.transcripts] == [
+            1.0 + self.model.score('open the file'),
+            2.0 + self.model.score('open a file'),
+        ]
+
+
+class TestModelRegistry(unittest.TestCase):
+    def setUp(self):
+        self.loaded = []
+        for patcher in [
+            mock.patch.dict(kenlmscorer._MODELS, clear=True),
+            mock.patch.object(kenlmscorer, '_load_model', side_effect=self.load),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'lm.binary')
+        with open(self.path, 'wb') as fh:
+            fh.write(b'model')
+        self.link = os.path.join(directory.name, 'link.binary')
+        os.symlink(self.path, self.link)
+
+    def load(self, path, lazy=True):
+        model = FakeModel()
+        self.loaded.append((path, lazy, model))
+        return model
+
+    def test_shared(self):
+        first = kenlmscorer.acquire_model(self.path)
+        second = kenlmscorer.acquire_model(self.link, lazy=False)
+        assert first is second
+        assert self.loaded == [(os.path.realpath(self.path), True, first)]
+
+    def test_release(self):
+        model = kenlmscorer.acquire_model(self.path)
+        kenlmscorer.acquire_model(self.path)
+        kenlmscorer.release_model(model)
+        # still referenced, so still shared
+        assert kenlmscorer.acquire_model(self.path) is model
+        kenlmscorer.release_model(model)
+        kenlmscorer.release_model(model)
+        assert kenlmscorer._MODELS == {}
+        assert kenlmscorer.acquire_model(self.path) is not model
+        assert len(self.loaded) == 2
+
+    def test_changed_file(self):
+        model = kenlmscorer.acquire_model(self.path)
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        fresh = kenlmscorer.acquire_model(self.path)
+        assert fresh is not model
+        assert len(self.loaded) == 2
+        # releasing the stale model does not unload the fresh one
+        kenlmscorer.release_model(model)
+        assert kenlmscorer.acquire_model(self.path) is fresh
+        assert len(kenlmscorer._MODELS) == 1
+
+    def test_scorers(self):
+        definition = models.ScorerDefinition(language_model=self.link, lazy_load=False)
+        scorers = [kenlmscorer.KenLMScorer(definition=definition) for i in range(2)]
+        assert scorers[0].preload() is scorers[1].preload()
+        assert self.loaded[0][1] is False, 'lazy_load not passed through'
+        scorers[0].close()
+        assert len(kenlmscorer._MODELS) == 1
+        scorers[1].close()
+        assert kenlmscorer._MODELS == {}
+        assert len(self.loaded) == 1
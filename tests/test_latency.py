@@ -0,0 +1,47 @@
+import unittest
+from listener import latency, models, eventserver
+
+
+class TestLatency(unittest.TestCase):
+    def test_stage_latencies(self):
+        timings = {'committed': 1.6, 'audio': 0.0, 'vad': 1.0, 'decoded': 1.25}
+        latencies = latency.stage_latencies(timings)
+        assert [stage for stage, _ in latencies] == [
+            'vad',
+            'decoded',
+            'committed',
+            latency.TOTAL,
+        ], latencies
+        assert [round(delay, 3) for _, delay in latencies] == [1.0, 0.25, 0.35, 1.6]
+        assert latency.stage_latencies({'audio': 1.0}) == []
+
+    def test_histogram(self):
+        histogram = latency.LatencyHistogram()
+        for value in [0.003] * 98 + [0.3, 4.0]:
+            histogram.add(value)
+        stats = histogram.stats()
+        assert stats['count'] == 100
+        assert stats['p50'] == 0.005, stats
+        assert stats['p99'] == 0.5, stats
+        assert stats['max'] == 4.0, stats
+
+    def test_tracker(self):
+        tracker = latency.LatencyTracker()
+        event = models.Utterance(timings={'audio': 1.0, 'decoded': 1.5})
+        latency.stamp(event, 'committed', 2.0)
+        tracker.record(event)
+        stats = tracker.stats()
+        assert sorted(stats) == ['committed', 'decoded', latency.TOTAL], stats
+        assert stats[latency.TOTAL]['mean'] == 1.0
+        assert models.Utterance().timings == {}, 'Timings shared between events'
+
+    def test_queued(self):
+        server = eventserver.EventServer('unused')
+        record = {'partial': False, 'transcripts': [], 'timings': {'decoded': 1.0}}
+        server.send(record)
+        assert 'queued' in record['timings'], record
+        untimed = {'partial': False, 'transcripts': []}
+        server.send(untimed)
+        assert 'timings' not in untimed, 'Stamped an event without timings'
+        latencies = dict(latency.stage_latencies(record['timings']))
+        assert 'queued' in latencies, latencies
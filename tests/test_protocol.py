@@ -0,0 +1,196 @@
+import unittest, socket, asyncio, tempfile, os
+from listener import protocol, eventserver, eventreceiver
+
+
+def utterance(count, partial=False):
+    return {
+        'partial': partial,
+        'final': not partial,
+        'transcripts': [{'text': 'x' * 20, 'words': [], 'confidence': count}],
+    }
+
+
+class TestProtocol(unittest.TestCase):
+    def setUp(self):
+        self.server, self.client = socket.socketpair()
+
+    def tearDown(self):
+        self.server.close()
+        self.client.close()
+
+    def send(self, record, format):
+        encoded = eventserver.EncodedEvent(record).encoded(format)
+        self.server.sendall(b''.join(encoded))
+
+    def read_all(self, reader):
+        self.server.close()
+        self.client.shutdown(socket.SHUT_WR)
+        messages = []
+        while reader.recv_from(self.client):
+            messages.extend(reader)
+        return messages
+
+    def test_legacy_client(self):
+        reader = protocol.FrameReader(protocol.LEGACY, size=8)
+        for i in range(3):
+            self.send({'count': i, 'text': 'x' * 20}, protocol.LEGACY)
+        messages = self.read_all(reader)
+        assert [message['count'] for message in messages] == [0, 1, 2], messages
+
+    def test_framed(self):
+        self.server.sendall(protocol.encode_hello(protocol.JSON))
+        reader = protocol.FrameReader(protocol.JSON, size=8)
+        for i in range(3):
+            self.send({'count': i, 'text': 'x' * 20}, protocol.JSON)
+        messages = self.read_all(reader)
+        assert reader.format == protocol.JSON
+        assert [message['count'] for message in messages] == [0, 1, 2], messages
+
+    def test_framed_msgpack(self):
+        if protocol.MSGPACK not in protocol.available_formats():
+            raise unittest.SkipTest('msgpack is not installed')
+        self.server.sendall(protocol.encode_hello(protocol.MSGPACK))
+        reader = protocol.FrameReader(protocol.MSGPACK, size=8)
+        for i in range(3):
+            self.send({'count': i, 'text': 'x' * 20}, protocol.MSGPACK)
+        messages = self.read_all(reader)
+        assert reader.format == protocol.MSGPACK
+        assert [message['count'] for message in messages] == [0, 1, 2], messages
+
+    def test_views_released(self):
+        """The buffer can grow while a caller is part-way through the messages"""
+        reader = protocol.FrameReader(protocol.LEGACY, size=64)
+        for i in range(3):
+            self.send({'count': i}, protocol.LEGACY)
+        reader.recv_from(self.client)
+        messages = iter(reader)
+        assert next(messages) == {'count': 0}
+        reader.make_room(1024)
+        assert len(reader.buffer) >= 1024
+        assert [message['count'] for message in messages] == [1, 2]
+
+    def test_legacy_server(self):
+        """Framing client falls back when the server does not reply with a HELLO"""
+        reader = protocol.FrameReader(protocol.JSON)
+        self.send({'count': 1}, protocol.LEGACY)
+        reader.recv_from(self.client)
+        assert list(reader) == [{'count': 1}]
+        assert reader.format == protocol.LEGACY
+
+    def test_free_space_grows(self):
+        reader = protocol.FrameReader(protocol.LEGACY, size=8)
+        for chunk in (b'{"count":1}\000{"count"', b':2}\000'):
+            while chunk:
+                with reader.free_space() as view:
+                    count = min(len(view), len(chunk))
+                    view[:count] = chunk[:count]
+                reader.wrote(count)
+                chunk = chunk[count:]
+        assert list(reader) == [{'count': 1}, {'count': 2}]
+        assert len(reader.buffer) > 8
+
+
+class TestEventServer(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.directory = tempfile.TemporaryDirectory()
+        self.sockname = os.path.join(self.directory.name, 'events')
+
+    def tearDown(self):
+        self.loop.close()
+        self.directory.cleanup()
+
+    def test_fan_out(self):
+        async def read(format, count):
+            events = eventreceiver.async_read_from_socket(
+                self.sockname, connect_backoff=0.01, format=format
+            )
+            result = []
+            async for event in events:
+                result.append(event.transcripts[0].confidence)
+                if len(result) == count:
+                    break
+            await events.aclose()
+            return result
+
+        async def run():
+            server = await eventserver.serve_events(self.sockname)
+            readers = [
+                asyncio.ensure_future(read(format, 3))
+                for format in protocol.available_formats() + [protocol.LEGACY]
+            ]
+            while len(server.clients) < len(readers):
+                await asyncio.sleep(0.01)
+            # give the clients time to negotiate
+            await asyncio.sleep(eventserver.HELLO_TIMEOUT + 0.1)
+            for i in range(3):
+                server.send(utterance(i))
+            results = await asyncio.gather(*readers)
+            server.close()
+            return results
+
+        for result in self.loop.run_until_complete(run()):
+            assert result == [0, 1, 2], result
+
+    def test_large_event(self):
+        """Events larger than the receive buffer arrive intact"""
+        record = utterance(1)
+        record['transcripts'][0]['text'] = 'x' * 200000
+
+        async def run():
+            server = await eventserver.serve_events(self.sockname)
+            events = eventreceiver.async_read_from_socket(
+                self.sockname, connect_backoff=0.01, format=protocol.JSON
+            )
+            reading = asyncio.ensure_future(events.__anext__())
+            while not server.clients:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(eventserver.HELLO_TIMEOUT + 0.1)
+            server.send(record)
+            event = await reading
+            await events.aclose()
+            server.close()
+            return event
+
+        event = self.loop.run_until_complete(run())
+        assert event.transcripts[0].text == record['transcripts'][0]['text']
+
+
+class TestClientQueue(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server, self.client = socket.socketpair()
+        _, writer = self.loop.run_until_complete(
+            asyncio.open_unix_connection(sock=self.server)
+        )
+        self.queue = eventserver.ClientQueue(writer, size=3, lag_limit=0.05)
+
+    def tearDown(self):
+        self.loop.close()
+        self.server.close()
+        self.client.close()
+
+    def event(self, partial, count):
+        return eventserver.EncodedEvent({'partial': partial, 'count': count})
+
+    def test_drops_partials_first(self):
+        self.queue.put(self.event(True, 0))
+        self.queue.put(self.event(False, 1))
+        self.queue.put(self.event(True, 2))
+        self.queue.put(self.event(False, 3))
+        self.queue.put(self.event(False, 4))
+        # no partials left to drop, so new partials are dropped
+        self.queue.put(self.event(True, 5))
+        counts = [event.record['count'] for _, event in self.queue.events]
+        assert counts == [1, 3, 4], counts
+        assert self.queue.dropped == 3
+
+    def test_evicts_stalled_client(self):
+        assert self.queue.put(self.event(False, 0))
+        assert self.loop.run_until_complete(self.queue.get()) is not None
+        self.queue.sending -= 1.0
+        assert not self.queue.put(self.event(False, 1))
+        assert self.queue.closed
+        assert self.loop.run_until_complete(self.queue.get()) is None
+        self.loop.run_until_complete(asyncio.sleep(0))
+        assert self.client.recv(10) == b''
@@ -0,0 +1,84 @@
+import unittest, io, socket
+import numpy as np
+from listener import ringbuffer
+
+
+def audio(count, start=0):
+    return np.arange(start, start + count, dtype=np.int16)
+
+
+class TestRingBuffer(unittest.TestCase):
+    def setUp(self):
+        self.ring = ringbuffer.RingBuffer(duration=1, rate=100)
+
+    def test_iterframes(self):
+        self.ring.buffer[:40] = audio(40)
+        frames = list(self.ring.iterframes(0, 40, 10))
+        assert len(frames) == 4, frames
+        for i, frame in enumerate(frames):
+            assert frame.base is self.ring.buffer, 'Frame was copied'
+            assert frame.tolist() == list(range(i * 10, (i + 1) * 10))
+
+    def test_iterframes_wrap(self):
+        self.ring.buffer[:] = audio(100)
+        frames = list(self.ring.iterframes(80, 20, 10))
+        assert [frame[0] for frame in frames] == [80, 90, 0, 10], frames
+        frames = list(self.ring.iterframes(95, 15, 10))
+        assert [frame.tolist() for frame in frames] == [
+            list(range(95, 100)) + list(range(0, 5)),
+            list(range(5, 15)),
+        ], frames
+
+    def test_distance(self):
+        assert self.ring.distance(10, 30) == 20
+        assert self.ring.distance(90, 10) == 20
+        assert self.ring.wrap(-10) == 90
+
+    def test_read_in_wraps(self):
+        self.ring.write_head = self.ring.start = 90
+        read = self.ring.read_in(io.BytesIO(audio(20).tobytes()), 20)
+        assert read == 20
+        assert self.ring.write_head == 10
+        assert self.ring.buffer[90:].tolist() == list(range(10))
+        assert self.ring.buffer[:10].tolist() == list(range(10, 20))
+        assert len(self.ring) == 20
+        assert self.ring.underruns == 0
+
+    def test_read_in_socket_counts_samples(self):
+        source, sink = socket.socketpair()
+        try:
+            source.sendall(audio(20).tobytes())
+            read = self.ring.read_in(sink, 20)
+            assert read == 20, read
+            assert self.ring.write_head == 20
+            assert self.ring.buffer[:20].tolist() == list(range(20))
+        finally:
+            source.close()
+            sink.close()
+
+    def test_read_in_disconnect(self):
+        read = self.ring.read_in(io.BytesIO(audio(5).tobytes() + b'x'), 20)
+        assert read == 5
+        assert self.ring.write_head == 5
+        assert self.ring.underruns == 1
+
+    def test_overflow_split(self):
+        self.ring.read_in(io.BytesIO(audio(90).tobytes()), 90)
+        assert not self.ring.overflowed
+        self.ring.read_in(io.BytesIO(audio(20).tobytes()), 20)
+        assert self.ring.overflowed
+        assert self.ring.overruns == 1
+        assert self.ring.start == 90
+        assert len(self.ring) == 20
+
+    def test_overflow_drop_oldest(self):
+        ring = ringbuffer.RingBuffer(
+            duration=1, rate=100, overflow=ringbuffer.OVERFLOW_DROP
+        )
+        ring.read_in(io.BytesIO(audio(90).tobytes()), 90)
+        ring.read_in(io.BytesIO(audio(20, 90).tobytes()), 20)
+        assert not ring.overflowed
+        assert ring.overruns == 1
+        assert len(ring) == 99
+        current = np.concatenate(list(ring.itercurrent()))
+        assert current.tolist() == list(range(11, 110))
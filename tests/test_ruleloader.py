@@ -0,0 +1,71 @@
+import unittest, os
+from unittest import mock
+from listener import ruleloader
+from tests import temporary_rule_cache, temporary_context_dir
+
+
+class TestRuleCache(unittest.TestCase):
+    def setUp(self):
+        self.rule_cache = temporary_rule_cache(self)
+        self.contexts = temporary_context_dir(self)
+
+    def write(self, name, content):
+        with open(os.path.join(self.contexts, '%s.rules' % (name,)), 'w') as fh:
+            fh.write(content)
+
+    def texts(self, name, restart=False):
+        """Load the rule-set, restart simulates a new process"""
+        if restart:
+            ruleloader._PARSED.clear()
+        rules, ruleset = ruleloader.load_rules(name)
+        return [rule.text for rule in ruleset]
+
+    def test_changed_file(self):
+        self.write('test', "hello => 'hi'\n")
+        assert self.texts('test') == ['hi']
+        self.write('test', "hello => 'howdy'\n")
+        assert self.texts('test') == ['howdy']
+        self.write('test', "hello => 'hey'\n")
+        assert self.texts('test', restart=True) == ['hey']
+
+    def test_changed_include(self):
+        self.write('base', "hello => 'hi'\n")
+        self.write('test', "#include base\nworld => 'earth'\n")
+        assert self.texts('test') == ['hi', 'earth']
+        self.write('base', "hello => 'howdy'\n")
+        assert self.texts('test', restart=True) == ['howdy', 'earth']
+
+    def test_touched_file(self):
+        self.write('test', "hello => 'hi'\n")
+        assert self.texts('test') == ['hi']
+        filename = os.path.join(self.contexts, 'test.rules')
+        stat = os.stat(filename)
+        os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        with mock.patch.object(
+            ruleloader, 'rule_records', side_effect=AssertionError('Re-parsed')
+        ):
+            assert self.texts('test', restart=True) == ['hi']
+            # the new mtime was written back, so the next check need not hash
+            with mock.patch.object(
+                ruleloader, 'content_hash', side_effect=AssertionError('Hashed')
+            ):
+                assert self.texts('test', restart=True) == ['hi']
+
+    def test_truncated_cache(self):
+        self.write('test', "hello => 'hi'\n")
+        assert self.texts('test') == ['hi']
+        filename = ruleloader.rule_cache_file('test')
+        for size in (os.stat(filename).st_size // 2, 0):
+            with open(filename, 'r+b') as fh:
+                fh.truncate(size)
+            assert ruleloader.read_rule_cache('test') is None
+            assert self.texts('test', restart=True) == ['hi']
+            # and the cache was re-written
+            assert ruleloader.read_rule_cache('test') is not None
+
+    def test_invalid_cache(self):
+        self.write('test', "hello => 'hi'\n")
+        assert self.texts('test') == ['hi']
+        with open(ruleloader.rule_cache_file('test'), 'wb') as fh:
+            fh.write(b'not a pickle')
+        assert self.texts('test', restart=True) == ['hi']
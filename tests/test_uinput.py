@@ -0,0 +1,201 @@
+import unittest, os, tempfile, threading
+from listener import uinputdriver, interpreter, ruleloader, models
+from listener.uinputdriver import EV_KEY, EV_SYN
+from tests import temporary_rule_cache
+
+
+def decode(content):
+    count = len(content) // uinputdriver.EVENT_SIZE
+    events = (uinputdriver.input_event * count).from_buffer_copy(content)
+    return [(event.type, event.code, event.value) for event in events]
+
+
+class TestUInput(unittest.TestCase):
+    def setUp(self):
+        # parsing and writing do not need the (privileged) device
+        self.uinput = uinputdriver.UInput.__new__(uinputdriver.UInput)
+        self.read_fd, self.uinput.fd = os.pipe()
+
+    def tearDown(self):
+        os.close(self.read_fd)
+        os.close(self.uinput.fd)
+
+    def test_compile_strokes(self):
+        events, batches = uinputdriver.compile_strokes([[1], [2, 3], [], [4]])
+        assert batches == [(0, 8), (8, 11)], batches
+        assert decode(bytes(events)[: 11 * uinputdriver.EVENT_SIZE]) == [
+            (EV_KEY, 1, 1),
+            (EV_KEY, 1, 0),
+            (EV_SYN, 0, 0),
+            (EV_KEY, 2, 1),
+            (EV_KEY, 3, 1),
+            (EV_KEY, 3, 0),
+            (EV_KEY, 2, 0),
+            (EV_SYN, 0, 0),
+            (EV_KEY, 4, 1),
+            (EV_KEY, 4, 0),
+            (EV_SYN, 0, 0),
+        ]
+
+    def test_sync_group(self):
+        events, batches = uinputdriver.compile_strokes([[1], [2], [3]], sync_group=2)
+        syncs = [event.type for event in events[: batches[-1][1]]].count(EV_SYN)
+        assert syncs == 2, syncs
+
+    def test_events_reused(self):
+        events, _ = uinputdriver.compile_strokes([[1, 2], [3, 4]])
+        reused, batches = uinputdriver.compile_strokes([[5]], events=events)
+        assert reused is events
+        # the previous string's press values are not left behind
+        assert decode(bytes(events)[: batches[-1][1] * uinputdriver.EVENT_SIZE]) == [
+            (EV_KEY, 5, 1),
+            (EV_KEY, 5, 0),
+            (EV_SYN, 0, 0),
+        ]
+        grown, _ = uinputdriver.compile_strokes([[1]] * 10, events=events)
+        assert grown is not events
+        assert len(grown) >= 30, len(grown)
+
+    def test_run_input_string_reuses_events(self):
+        self.uinput.run_input_string('Hello')
+        events = self.uinput.events
+        os.read(self.read_fd, 4096)
+        self.uinput.run_input_string('Hi')
+        assert self.uinput.events is events
+        written = decode(os.read(self.read_fd, 4096))
+        assert [type for type, _, _ in written].count(EV_SYN) == 2, written
+
+    def test_run_input_string(self):
+        self.uinput.run_input_string('Hi!')
+        written = decode(os.read(self.read_fd, 4096))
+        mapping = self.uinput.get_key_mapping()
+        pressed = [code for type, code, value in written if type == EV_KEY and value]
+        assert pressed == mapping['H'] + mapping['i'] + mapping['!'], pressed
+        assert [type for type, _, _ in written].count(EV_SYN) == 3
+
+    def test_parse_markup(self):
+        mapping = self.uinput.get_key_mapping()
+        strokes = self.uinput.parse_input_string('<<>a<>><ctrl+c><PAUSE>é\n')
+        assert strokes == [
+            mapping['<'],
+            mapping['a'],
+            mapping['>'],
+            mapping['CTRL'] + mapping['c'],
+            [],
+            mapping['ENTER'],
+        ], strokes
+
+
+class FakeDevice(object):
+    def __init__(self):
+        self.typed = []
+        self.closed = False
+
+    def run_input_string(self, content, sync_group=1, pace=0.0, wait=None):
+        self.typed.append(content)
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+class TestUInputSession(unittest.TestCase):
+    def test_session_reuses_device(self):
+        devices = []
+
+        def factory():
+            devices.append(FakeDevice())
+            return devices[-1]
+
+        session = uinputdriver.UInputSession(factory=factory)
+        session.type('hello')
+        session.type('<ENTER>')
+        session.close(timeout=5)
+        assert len(devices) == 1, devices
+        assert devices[0].typed == ['hello', '<ENTER>'], devices[0].typed
+        assert devices[0].closed
+
+    def test_find_event_node(self):
+        with tempfile.TemporaryDirectory() as sysfs:
+            with tempfile.TemporaryDirectory() as devices:
+                os.makedirs(os.path.join(sysfs, 'input7', 'event12'))
+                assert not uinputdriver.find_event_node('input7', sysfs, devices)
+                open(os.path.join(devices, 'event12'), 'w').close()
+                node = uinputdriver.find_event_node('input7', sysfs, devices)
+                assert node == os.path.join(devices, 'event12'), node
+                assert not uinputdriver.find_event_node('input8', sysfs, devices)
+
+    def test_device_failure(self):
+        attempts = []
+
+        def factory():
+            attempts.append(True)
+            if len(attempts) == 1:
+                raise OSError('No uinput device')
+            return FakeDevice()
+
+        session = uinputdriver.UInputSession(factory=factory)
+        failed = session.type('hello')
+        with self.assertRaises(OSError):
+            failed.result(5)
+        # the next request retries creating the device
+        assert session.type('there').result(5) is True
+        session.close(timeout=5)
+
+    def test_cancel(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        class SlowDevice(FakeDevice):
+            def run_input_string(self, content, sync_group=1, pace=0.0, wait=None):
+                started.set()
+                release.wait(5)
+                return not wait(0.01)
+
+        session = uinputdriver.UInputSession(factory=SlowDevice)
+        first = session.type('first')
+        second = session.type('second')
+        assert started.wait(5)
+        session.cancel()
+        release.set()
+        third = session.type('third')
+        assert first.result(5) is False, 'Current request not interrupted'
+        assert second.cancelled(), 'Queued request not cancelled'
+        assert third.result(5) is True
+        session.close(timeout=5)
+
+    def test_stop_typing_command(self):
+        """A "scratch that" utterance interrupts typing in the process session"""
+        temporary_rule_cache(self)
+        started = threading.Event()
+
+        class SlowDevice(FakeDevice):
+            def run_input_string(self, content, sync_group=1, pace=0.0, wait=None):
+                started.set()
+                return not wait(5)
+
+        session = uinputdriver.UInputSession(factory=SlowDevice)
+        original, uinputdriver._SESSION = uinputdriver._SESSION, session
+        try:
+            typing = uinputdriver.get_session().type('a long paragraph')
+            assert started.wait(5)
+            rules, _ = ruleloader.load_rules('typing')
+            words = models.apply_rules(
+                models.Transcript(words=['scratch', 'that']),
+                rules,
+                interpreter=interpreter.Interpreter(),
+            )
+            assert words == [], words
+            assert typing.result(5) is False, 'Typing was not interrupted'
+        finally:
+            uinputdriver._SESSION = original
+            session.close(timeout=5)
+
+    def test_pace(self):
+        uinput = uinputdriver.UInput.__new__(uinputdriver.UInput)
+        writes = []
+        uinput.write_events = lambda events, start, stop: writes.append((start, stop))
+        waits = []
+        assert uinput.run_input_string('ab<PAUSE>c', pace=0.5, wait=waits.append)
+        assert writes == [(0, 3), (3, 6), (6, 9)], writes
+        assert waits == [0.5, 0.5, uinputdriver.PAUSE_DURATION, 0.5], waits